@@ -1,9 +1,14 @@
 #
 #   Using streamlit to create an online app
 #
+import os
 import streamlit as st
 import sys
 
+# Streamlit reruns solve the same structures over and over: keep their
+# results on disk, here and in the worker processes
+os.environ.setdefault("DTMM_CACHE", "1")
+
 sys.path.append("/dTMM_Schrodinger/python_implementation/ui")
 
 from ui.home import HomePage
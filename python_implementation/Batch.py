@@ -0,0 +1,52 @@
+#
+#   Command-line batch runner: solves every job of a JSON job file and writes
+#   one JSON line per result as it completes. Run from python_implementation/,
+#   e.g.
+#       python Batch.py test/batch_jobs.json --output results.jsonl
+#
+
+import argparse
+import json
+import sys
+
+from src import ResultCache
+from src import SolverStats
+from src.BatchRunner import BatchRunner, load_jobs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Solve the jobs of a JSON job file.")
+    parser.add_argument("jobs", help="JSON job file, see src/BatchRunner.load_jobs")
+    parser.add_argument("-o", "--output", help="JSONL file to write, standard output if not given")
+    parser.add_argument("--wavefunctions", metavar="DIR",
+                        help="also write z, energies and wavefunctions to DIR/<job>_<index>.npz")
+    parser.add_argument("--serial", action="store_true", help="solve in this process, one job at a time")
+    parser.add_argument("--stats", action="store_true", help="add per-phase solver stats to each result")
+    parser.add_argument("--cache", action="store_true",
+                        help="read and write the on-disk result cache, also on when DTMM_CACHE=1")
+    args = parser.parse_args()
+
+    runner = BatchRunner(load_jobs(args.jobs))
+    runner.set_parallel(not args.serial)
+    runner.set_wavefunctions(args.wavefunctions)
+    runner.set_stats(args.stats or SolverStats.is_enabled())
+    runner.set_cache(args.cache or ResultCache.is_enabled())
+
+    out = open(args.output, "w") if args.output else sys.stdout
+    failed = 0
+    try:
+        for record in runner.iter_results():
+            failed += "error" in record
+            out.write(json.dumps(record) + "\n")
+            out.flush()
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    if failed:
+        print(f"{failed} of {len(runner.tasks)} jobs failed", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
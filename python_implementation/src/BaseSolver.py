@@ -4,10 +4,16 @@
 
 from abc import ABC, abstractmethod
 from src.Grid import Grid
+from src import ResultCache
+from src import SolverStats
 
 import numpy as np
+import time
 
 class BaseSolver(ABC):
+    # Attributes that do not change the result, left out of the cache key
+    _CACHE_IGNORED = {"G", "cache", "stats", "parallel", "warm_start", "iterations"}
+
     def __init__(self, Grid:Grid, nEmax) -> None:
         """Base Solver class for all TMM and FDM solvers
 
@@ -16,13 +22,94 @@ class BaseSolver(ABC):
             nEmax (int): Max number of energy levels
         """
 
+        self.stats = SolverStats.new_stats()
+
         self.G = Grid
-        self.V = self.G.get_bandstructure_potential()
-        self.meff = self.G.get_effective_mass()
+        with self.stats.phase("grid_profiles"):
+            self.V = self.G.get_bandstructure_potential()
+            self.meff = self.G.get_effective_mass()
         self.nE = nEmax
         
         self.tolerance = np.float64(10e-16)
+        self.parallel = True
+        self.cache = ResultCache.get_default_cache()
+
+    # Set methods
+    def set_parallel(self, val):
+        """Spread independent work (roots, spectrum slices) over the shared
+        worker pool (True) or keep it in this process (False), e.g. when the
+        solver already runs inside a worker."""
+        self.parallel = bool(val)
+
+    def set_warm_start(self, state):
+        """Start from the result of a previous solve on a nearby structure.
+        Solvers that cannot use one ignore it."""
+        pass
+
+    def get_warm_start(self):
+        """State to pass to set_warm_start of the next solver, or None."""
+        return None
+
+    def set_stats(self, val):
+        """Record per-phase timings and counters of later solves. To include
+        the profiles fetched on construction, create the solver inside
+        SolverStats.recording instead.
+
+        Args:
+            val (bool | SolverStats): True for a fresh SolverStats, False to
+                stop recording, or a SolverStats to add to, e.g. one shared by
+                several solvers
+        """
+        if val is True:
+            val = SolverStats.SolverStats()
+        elif val is False or val is None:
+            val = SolverStats.NULL_STATS
+        self.stats = val
+
+    def get_stats(self):
+        """SolverStats of this solver, or NULL_STATS when not recording."""
+        return self.stats
+
+    def set_cache(self, cache):
+        """Result cache to read and write, or None to always solve.
+
+        Args:
+            cache (ResultCache | None): Defaults to ResultCache.get_default_cache(),
+                None unless the cache is turned on
+        """
+        self.cache = cache
+
+    def get_cache_key(self):
+        """Hash of everything the result depends on: the solver class, its
+        profiles and settings and those of the Grid."""
+        inputs = {key: val for key, val in vars(self).items()
+                  if not key.startswith("_") and key not in self._CACHE_IGNORED}
+        inputs.update({"G." + key: val for key, val in vars(self.G).items()
+                       if not key.startswith("_") and key != "material"})
+        inputs["class"] = f"{type(self).__module__}.{type(self).__qualname__}"
+        return ResultCache.get_key(inputs)
 
-    @abstractmethod
     def get_wavefunctions(self):
-        pass
\ No newline at end of file
+        """Energies (J) and wavefunctions of the states, taken from the
+        cache when the same problem has been solved before. A result from the
+        cache leaves no warm start for the next solver."""
+        with self.stats.phase("solve"):
+            if self.cache is None:
+                return self.compute_wavefunctions()
+
+            with self.stats.phase("cache"):
+                key = self.get_cache_key()
+                result = self.cache.get(key)
+            if result is not None:
+                self.stats.count("cache_hits")
+                return result
+
+            start = time.perf_counter()
+            result = self.compute_wavefunctions()
+            with self.stats.phase("cache"):
+                self.cache.put(key, *result, elapsed=time.perf_counter() - start)
+            return result
+
+    @abstractmethod
+    def compute_wavefunctions(self):
+        pass
@@ -0,0 +1,206 @@
+#
+#   Headless batch runs for scripts and cluster pipelines. Jobs read from a
+#   JSON job file are solved in the shared worker pool and each result is
+#   handed back as soon as it completes. Imports neither plotly nor
+#   streamlit.
+#
+
+from concurrent.futures import as_completed
+import contextlib
+from dataclasses import dataclass, field
+import json
+import os
+import time
+
+import numpy as np
+
+from src import ConstAndScales
+from src import ResultCache
+from src import SolverStats
+from src.Composition import Composition
+from src.Grid import Grid
+from src.Solvers_FDM import SolverFactory
+from src.TransitionCalculator import TransitionCalculator
+from src.WorkerPool import get_pool
+
+# Values a job takes when neither it nor the file's "defaults" set them
+JOB_DEFAULTS = {
+    "material": "AlGaAs",
+    "dz": 1.0,                  # Å
+    "K": [0.0],                 # kV/cm, a value or a list
+    "solver": "TMM",
+    "nonparabolicity": "Parabolic",
+    "nstmax": 10,
+    "settings": {},             # setter name -> value, e.g. {"scan_mode": "nodes"}
+    "transitions": [],          # [[i, j], ...] or "all"
+}
+
+
+@dataclass
+class BatchTask:
+    """One solve: a job of the job file at one of its biases."""
+    job: str
+    index: int                  # position of K in the job's K list
+    layers: list                # [[thickness in Å, alloy fraction], ...]
+    material: str
+    dz: float
+    K: float
+    solver: str
+    nonparabolicity: str
+    nstmax: int
+    settings: dict = field(default_factory=dict)
+    transitions: list = field(default_factory=list)
+    wavefunctions: str = None   # directory for the .npz output, or None
+    stats: bool = False
+    cache: bool = False
+
+    def get_name(self):
+        return f"{self.job}_{self.index}"
+
+
+def load_jobs(path):
+    """Tasks of a job file.
+
+    The file holds either a list of jobs or an object with "jobs" and
+    optional "defaults". Each job gives its structure as "layer_file"
+    (relative to the job file) or as inline "layers", an optional "name",
+    and any of the keys of JOB_DEFAULTS to override. A job with a list of K
+    values gives one task per value.
+
+    Returns:
+        list: BatchTask objects, in file order
+    """
+    with open(path) as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        data = {"jobs": data}
+    defaults = {**JOB_DEFAULTS, **data.get("defaults", {})}
+    base = os.path.dirname(os.path.abspath(path))
+
+    tasks = []
+    for n, job in enumerate(data["jobs"]):
+        job = {**defaults, **job}
+        name = str(job.get("name", n))
+
+        if "layers" in job:
+            layers = [list(map(float, layer)) for layer in job["layers"]]
+        elif "layer_file" in job:
+            C = Composition.from_file(os.path.join(base, job["layer_file"]))
+            layers = C.as_array().tolist()
+        else:
+            raise ValueError(f"Job {name} has neither layers nor layer_file")
+
+        for index, K in enumerate(np.atleast_1d(job["K"]).tolist()):
+            tasks.append(BatchTask(name, index, layers, job["material"], float(job["dz"]), K,
+                                   job["solver"], job["nonparabolicity"], int(job["nstmax"]),
+                                   dict(job["settings"]), job["transitions"]))
+    return tasks
+
+
+def run_task(task, in_worker=False):
+    """Solve one task.
+
+    Returns:
+        dict: JSON-ready record with the energies in meV, the selected
+            transitions, the elapsed time and, when recorded, the solver
+            stats; or the error message if the solve failed
+    """
+    record = {"job": task.job, "index": task.index, "K": task.K, "solver": task.solver,
+              "nonparabolicity": task.nonparabolicity, "material": task.material, "dz": task.dz}
+    start = time.perf_counter()
+    try:
+        G = Grid(Composition.from_array(task.layers), task.dz, task.material)
+        G.set_K(task.K)
+        with SolverStats.recording() if task.stats else contextlib.nullcontext():
+            solver = SolverFactory.create(G, task.solver, task.nonparabolicity, task.nstmax)
+        solver.set_cache(ResultCache.get_cache() if task.cache else None)
+        if in_worker:
+            solver.set_parallel(False)
+        for name, val in task.settings.items():
+            getattr(solver, "set_" + name)(val)
+
+        energies, psis = solver.get_wavefunctions()
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+        record["time"] = time.perf_counter() - start
+        return record
+
+    record["energies"] = (energies / ConstAndScales.meV).tolist()
+    record["transitions"] = get_transitions(G.z, energies, psis, task.transitions)
+    if task.wavefunctions is not None:
+        path = os.path.join(task.wavefunctions, task.get_name() + ".npz")
+        np.savez_compressed(path, z=G.z, energies=energies, psis=np.array(psis).reshape(len(energies), -1))
+        record["wavefunctions"] = path
+    record["time"] = time.perf_counter() - start
+    if task.stats:
+        record["stats"] = solver.get_stats().as_dict()
+    return record
+
+
+def get_transitions(z, energies, psis, pairs):
+    """Energy difference in meV, and dipole and oscillator strength in the
+    units of TransitionCalculator, of each (i, j) pair with both levels
+    found, or of every pair i > j for "all"."""
+    n = len(energies)
+    if n == 0:
+        return []
+    ediff, dipoles, osc = TransitionCalculator().get_transition_matrices(z, energies, psis)
+    if pairs == "all":
+        pairs = [(i, j) for i in range(2, n+1) for j in range(1, i)]
+
+    return [{"i": i, "j": j, "ediff": ediff[i-1, j-1] / ConstAndScales.meV,
+             "dipole": float(dipoles[i-1, j-1]), "osc_strength": float(osc[i-1, j-1])}
+            for i, j in pairs if max(i, j) <= n]
+
+
+class BatchRunner:
+    def __init__(self, tasks) -> None:
+        """Runs BatchTasks, in the shared worker pool by default.
+
+        Args:
+            tasks (list): BatchTask objects, e.g. from load_jobs
+        """
+        self.tasks = tasks
+        self.parallel = True
+
+    # Set methods
+    def set_parallel(self, val):
+        """Solve the tasks in the shared worker pool (True) or one after the
+        other in this process."""
+        self.parallel = bool(val)
+
+    def set_wavefunctions(self, directory):
+        """Write each task's z, energies and wavefunctions to
+        <directory>/<job>_<index>.npz. None turns this off."""
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        for task in self.tasks:
+            task.wavefunctions = directory
+
+    def set_stats(self, val):
+        """Record SolverStats for each task and add them to its record."""
+        for task in self.tasks:
+            task.stats = bool(val)
+
+    def set_cache(self, val):
+        """Use the on-disk result cache (True) or always solve (False, the
+        default)."""
+        for task in self.tasks:
+            task.cache = bool(val)
+
+    def iter_results(self):
+        """Yield the record of each task as soon as it completes, in order of
+        completion when running in the pool. Closing the generator cancels
+        the tasks that have not started."""
+        if self.parallel and len(self.tasks) > 1:
+            pool = get_pool()
+            futures = [pool.submit(run_task, task, True) for task in self.tasks]
+            try:
+                for f in as_completed(futures):
+                    yield f.result()
+            finally:
+                for f in futures:
+                    f.cancel()
+        else:
+            for task in self.tasks:
+                yield run_task(task)
@@ -6,24 +6,194 @@
 from src.BaseSolver import BaseSolver
 from src.Grid import Grid
 from src import ConstAndScales
+from src import FDMKernels
+from src.WorkerPool import get_pool
 
 from abc import abstractmethod
+from dataclasses import dataclass
 import math
 import numpy as np
 import scipy.sparse as sp
 import scipy.sparse.linalg as spla
+import warnings
 
 # import cmath
 
+@dataclass
+class WarmStart:
+    """Result of an FDM solve, used to start the next one on a nearby
+    structure, e.g. the neighbouring point of a sweep.
+
+    Only the ARPACK solves use it: the Kane companion and Taylor solvers take
+    their start vector from it and Taylor also trims k to its number of
+    states. The shift is not moved. The Parabolic tridiagonal solve, the
+    Kane nonlinear engine and spectrum slicing ignore it."""
+    z: np.ndarray               # grid of the solve, in m
+    energies: np.ndarray        # kept eigenvalues, in J
+    vectors: np.ndarray         # their full eigenvectors, as columns
+
+    def get_start_vector(self, z, n):
+        """Sum of the normalised eigenvectors, interpolated onto the grid z.
+
+        Args:
+            z (np.ndarray): New grid, in m
+            n (int): Size of the new problem, a multiple of len(z)
+
+        Returns:
+            np.ndarray | None: Start vector of length n, or None when the
+                problems do not have the same number of blocks
+        """
+        blocks = self.vectors.shape[0] // len(self.z)
+        if self.vectors.shape[1] == 0 or n != blocks*len(z):
+            return None
+        v = self.vectors / np.linalg.norm(self.vectors, axis=0)
+        v = v.sum(axis=1).reshape(blocks, len(self.z))
+        return np.concatenate([np.interp(z, self.z, block) for block in v])
+
 class FDMSolver(BaseSolver):
     def __init__(self, Grid:Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
-        self.alpha = Grid.get_alpha_kane()
+        with self.stats.phase("grid_profiles"):
+            self.alpha = Grid.get_alpha_kane()
+        self.energy_window = None       # meV, defaults to [min(V), max(V)]
+        self.spectrum_slices = 0
+        self.warm_start = None
+        self._last_solve = None
+
+    # Set methods
+    def set_energy_window(self, Emin, Emax):
+        """Only keep eigenvalues between Emin and Emax, in meV. Pass None for
+        either to fall back to min(V) or max(V)."""
+        self.energy_window = (Emin, Emax)
+
+    def set_spectrum_slices(self, val):
+        """Split the energy window into this many slices, count the states in
+        each from the inertia of A - E B and solve every non-empty slice for
+        exactly that many states. 0 solves around a single shift. Only used
+        by solvers whose problem is a symmetric tridiagonal pencil
+        (get_pencil); the others warn and solve around a single shift."""
+        self.spectrum_slices = max(0, int(val))
+        if self.spectrum_slices > 0 and type(self).get_pencil is FDMSolver.get_pencil:
+            warnings.warn(f"{type(self).__name__} has no pencil to slice, solving around a single shift")
+
+    def set_warm_start(self, state):
+        """Start ARPACK from a previous solve: its eigenvectors, interpolated
+        onto this grid, as the start vector and, for solvers with a pencil
+        whose result can be checked by inertia (Taylor), k trimmed to its
+        number of states plus a margin. The shift stays where it is without a
+        warm start. A trimmed solve that misses states is repeated without
+        the warm start.
+
+        Args:
+            state (WarmStart | None): From get_warm_start of a previous solver
+        """
+        self.warm_start = state
+
+    def get_warm_start(self):
+        """WarmStart from the last get_wavefunctions call, or None."""
+        return self._last_solve
+
+    def get_arpack_settings(self, n, sigma, trim=False):
+        """k, shift and start vector for an ARPACK solve of size n.
+
+        The shift is always sigma: moving it towards the previous states
+        loses the lowest states when a structure changes, e.g. when a well
+        widens and a new ground state appears.
+
+        Args:
+            n (int): Size of the problem
+            sigma (float): Shift in J
+            trim (bool): Trim k to the warm start's number of states plus a
+                margin. Only for solvers whose result is_complete can check.
+
+        Returns:
+            tuple: k, sigma and v0 (None for a random start)
+        """
+        k = min(max(20, self.nE), n-2)
+        v0 = None
+        if self.warm_start is not None and len(self.warm_start.energies) > 0:
+            energies = self.warm_start.energies
+            if trim:
+                k = min(max(len(energies) + max(4, len(energies)//4), self.nE), n-2)
+            v0 = self.warm_start.get_start_vector(self.G.get_z(), n)
+        return k, sigma, v0
+
+    def is_complete(self, eigenvalues):
+        """Whether eigenvalues hold the lowest states of the energy window:
+        all of them, or the lowest nE. Checked against the inertia count of
+        get_pencil; solvers without a pencil cannot be checked and pass.
+
+        Args:
+            eigenvalues (np.ndarray): Eigenvalues in J, in any order
+        """
+        pencil = self.get_pencil()
+        if pencil is None:
+            return True
+
+        Emin, Emax = self.get_energy_window()
+        below = self.count_eigenvalues_below([Emin, Emax], pencil)
+        expected = below[1] - below[0]
+        needed = expected if self.nE <= 0 else min(self.nE, expected)
+        inside = np.sort(eigenvalues[(Emin < eigenvalues) & (eigenvalues < Emax)])
+        if len(inside) < needed:
+            return False
+        if needed == 0:
+            return True
+        # The needed lowest found states must be the needed lowest states
+        top = inside[needed-1] + 1e-6*ConstAndScales.meV
+        return self.count_eigenvalues_below(top, pencil)[0] - below[0] == needed
+
+    def get_energy_window(self):
+        """Window of kept eigenvalues, in J."""
+        Emin, Emax = self.energy_window if self.energy_window is not None else (None, None)
+        Emin = min(self.V) if Emin is None else Emin*ConstAndScales.meV
+        Emax = max(self.V) if Emax is None else Emax*ConstAndScales.meV
+        return Emin, Emax
 
     @abstractmethod
     def construct_matrix(self):      
         pass
 
+    @staticmethod
+    def _tridiagonal(lower, diag, upper, format="csr"):
+        """Sparse tridiagonal matrix; lower[i] sits in row i+1 and upper[i]
+        in row i."""
+        n = len(diag)
+        return sp.diags([lower, diag, upper], [-1, 0, 1], shape=(n, n), format=format)
+
+    def _kinetic_tridiagonal(self, meff):
+        """Parabolic Hamiltonian for the effective mass profile meff. Row nz-1
+        has no sub-diagonal entry and the end points copy the diagonal of
+        their neighbour."""
+        nz = self.G.get_nz()
+        scale = math.pow( (ConstAndScales.HBAR / self.G.get_dz()), 2) / 4.0
+        inv_m = 1.0/meff
+
+        lower = np.zeros(nz-1)
+        lower[:-1] = -scale * (inv_m[:-2] + inv_m[1:-1])
+        upper = -scale * (inv_m[1:] + inv_m[:-1])
+        diag = np.empty(nz)
+        diag[1:-1] = self.V[1:-1] + scale * (inv_m[2:] + 2.0*inv_m[1:-1] + inv_m[:-2])
+        diag[0] = diag[1]
+        diag[-1] = diag[-2]
+
+        return self._tridiagonal(lower, diag, upper)
+
+    @staticmethod
+    def _leading_block(A):
+        """Diagonal and off-diagonal, in meV, of the symmetric block left once
+        the decoupled last point of _kinetic_tridiagonal is dropped. Working
+        in meV keeps the tridiagonal bisection tolerances well scaled."""
+        return A.diagonal(0)[:-1]/ConstAndScales.meV, A.diagonal(1)[:-1]/ConstAndScales.meV
+
+    @staticmethod
+    def _neighbours(a):
+        """Values at i+1 and i-1 for every point, with the boundary points
+        using their own value on both sides."""
+        plus = np.concatenate((a[:1], a[2:], a[-1:]))
+        minus = np.concatenate((a[:1], a[:-2], a[-1:]))
+        return plus, minus
+
     def sort_and_filter_eigenvalues(self, eigenvalues, Vmin=None, Vmax=None):
         if Vmin is None:
             Vmin = min(self.V)
@@ -37,19 +207,22 @@ class FDMSolver(BaseSolver):
         valid_pos = [idx for idx in posEfound if Vmin < eigenvalues[idx].real < Vmax]
         return valid_pos
 
-    def get_wavefunctions(self):
-        psis = []
-        energies = []
+    def solve_eigenproblem(self):
+        """Eigenpairs of construct_matrix, shift-inverted around the middle of
+        the energy window when the matrix is sparse.
 
-        nz = self.G.get_nz()
-        A = self.construct_matrix()
+        Returns:
+            tuple: Real eigenvalues in J and eigenvectors as columns. Only the
+                eigenvalues inside get_energy_window are used afterwards.
+        """
+        with self.stats.phase("assembly"):
+            A = self.construct_matrix()
 
         if sp.issparse(A):
             # Recognised sparse matrix, use sparse solver
             A_sparse = sp.csr_matrix(A)
-            k = min(max(20, self.nE), A_sparse.shape[0]-2) # type: ignore
-            sigma = np.mean([min(self.V), max(self.V)])
-            eigenvalues, eigenvectors = spla.eigs(A_sparse, k=k, sigma=sigma, which="LM") # type: ignore
+            k, sigma, v0 = self.get_arpack_settings(A_sparse.shape[0], np.mean(self.get_energy_window())) # type: ignore
+            eigenvalues, eigenvectors = spla.eigs(A_sparse, k=k, sigma=sigma, which="LM", v0=v0) # type: ignore
             eigenvectors = eigenvectors.real # type: ignore
             eigenvalues = eigenvalues.real # type: ignore
         else:                   
@@ -58,21 +231,137 @@ class FDMSolver(BaseSolver):
             eigenvectors = eigenvectors.real
             eigenvalues = eigenvalues.real
 
-        Eidx = self.sort_and_filter_eigenvalues(eigenvalues)
+        return eigenvalues, eigenvectors
+
+    def get_pencil(self):
+        """Symmetric tridiagonal matrices (A, B), B positive definite, with
+        A psi = E B psi, or None when the problem is not of that form."""
+        return None
+
+    def count_eigenvalues_below(self, shifts, pencil=None):
+        """Number of eigenvalues of the pencil below each shift.
+
+        By Sylvester's law of inertia this is the number of negative pivots in
+        the LDL^T factorisation of A - shift B, which for a tridiagonal matrix
+        is a single recurrence over the grid. It runs compiled in FDMKernels,
+        or without numba for all shifts at once in a loop over the grid.
+
+        Args:
+            shifts (np.ndarray): Energies in J
+            pencil (tuple): (A, B) from get_pencil, built if not given
+
+        Returns:
+            np.ndarray: Counts, one per shift
+        """
+        A, B = self.get_pencil() if pencil is None else pencil
+        shifts = np.atleast_1d(np.asarray(shifts, dtype=np.float64))
+        if FDMKernels.HAVE_NUMBA:
+            return FDMKernels.count_negative_pivots(A.diagonal(), A.diagonal(1), B.diagonal(), B.diagonal(1), shifts)
+
+        diag = A.diagonal()[:, None] - shifts*B.diagonal()[:, None]
+        off2 = (A.diagonal(1)[:, None] - shifts*B.diagonal(1)[:, None])**2
+        tiny = np.finfo(np.float64).tiny
+
+        counts = np.zeros(len(shifts), dtype=int)
+        d = diag[0]
+        for i in range(len(diag)):
+            if i > 0:
+                d = diag[i] - off2[i-1]/d
+            d = np.where(d == 0, -tiny, d)
+            counts += d < 0
+        return counts
+
+    def solve_sliced(self, pencil):
+        """Eigenpairs of the pencil inside the energy window, solved slice by
+        slice with as many states as each slice holds.
+
+        Returns:
+            tuple: Eigenvalues in J and eigenvectors as columns
+        """
+        A, B = pencil
+        Emin, Emax = self.get_energy_window()
+        edges = np.linspace(Emin, Emax, self.spectrum_slices+1)
+        with self.stats.phase("inertia"):
+            counts = self.count_eigenvalues_below(edges, pencil)
+        counts -= counts[0]
+
+        # Only the slices up to the one holding state nE are needed
+        if self.nE > 0 and counts[-1] > self.nE:
+            last = np.argmax(counts >= self.nE)
+            edges, counts = edges[:last+1], counts[:last+1]
+
+        tasks = [(A, B, edges[j], edges[j+1], counts[j+1]-counts[j])
+                 for j in range(len(edges)-1) if counts[j+1] > counts[j]]
+        if self.parallel and len(tasks) > 1:
+            results = list(get_pool().map(_solve_slice, *zip(*tasks)))
+        else:
+            results = [_solve_slice(*task) for task in tasks]
+
+        if not results:
+            return np.array([]), np.zeros((A.shape[0], 0))
+
+        eigenvalues = np.concatenate([vals for vals, _ in results])
+        eigenvectors = np.hstack([vecs for _, vecs in results])
+        if len(eigenvalues) != counts[-1]:
+            warnings.warn(f"Spectrum slicing found {len(eigenvalues)} of {counts[-1]} states")
+        return eigenvalues, eigenvectors
+
+    def compute_wavefunctions(self):
+        psis = []
+        energies = []
+
+        nz = self.G.get_nz()
+        with self.stats.phase("eigensolve"):
+            pencil = None
+            if self.spectrum_slices > 0:
+                with self.stats.phase("assembly"):
+                    pencil = self.get_pencil()
+            if pencil is not None:
+                eigenvalues, eigenvectors = self.solve_sliced(pencil)
+            else:
+                eigenvalues, eigenvectors = self.solve_eigenproblem()
+                if self.warm_start is not None and not self.is_complete(eigenvalues):
+                    # The trimmed warm solve missed states: solve cold
+                    self.stats.count("warm_start_fallbacks")
+                    warm_start, self.warm_start = self.warm_start, None
+                    try:
+                        eigenvalues, eigenvectors = self.solve_eigenproblem()
+                    finally:
+                        self.warm_start = warm_start
+
+        Eidx = self.sort_and_filter_eigenvalues(eigenvalues, *self.get_energy_window())
 
         if self.nE <= 0 or self.nE > len(Eidx):
             nE = len(Eidx)
         else:
             nE = self.nE
 
-        for i in range(nE):
-            E = eigenvalues[Eidx[i]]
-            psiWhole = eigenvectors[:, Eidx[i]]
+        kept = Eidx[:nE]
+        self._last_solve = WarmStart(self.G.get_z(), eigenvalues[kept], eigenvectors[:, kept])
+        self.stats.count("states", nE)
 
-            energies.append(E)
-            psi = psiWhole[:nz]
-            norm_const = math.sqrt(1 / np.trapezoid(abs(psi)**2) ) / self.G.get_dz() * ConstAndScales.ANGSTROM
-            psi = norm_const * psi
-            psis.append(psi)
+        with self.stats.phase("wavefunctions"):
+            for i in range(nE):
+                E = eigenvalues[Eidx[i]]
+                psiWhole = eigenvectors[:, Eidx[i]]
+
+                energies.append(E)
+                psi = psiWhole[:nz]
+                norm_const = math.sqrt(1 / np.trapezoid(abs(psi)**2) ) / self.G.get_dz() * ConstAndScales.ANGSTROM
+                psi = norm_const * psi
+                psis.append(psi)
 
         return np.array(energies), psis
+
+
+def _solve_slice(A, B, lo, hi, count):
+    # Every eigenvalue in [lo, hi) is closer to the midpoint than any outside
+    # it, so the count nearest eigenvalues are exactly the slice. Two extra
+    # guard against ties at the edges.
+    sigma = 0.5*(lo + hi)
+    k = min(count + 2, A.shape[0]-2)
+    lu = spla.splu(sp.csc_matrix(A - sigma*B))
+    OPinv = spla.LinearOperator(A.shape, matvec=lu.solve, dtype=np.float64)
+    eigenvalues, eigenvectors = spla.eigsh(A, k=k, M=B, sigma=sigma, which="LM", OPinv=OPinv)
+    keep = (lo <= eigenvalues) & (eigenvalues < hi)
+    return eigenvalues[keep], eigenvectors[:, keep]
@@ -28,24 +28,23 @@ class Grid:
         self.nz = np.size(self.z)
         self.material = Material.Material(HeterostructureMaterial)
 
-        # Find the cumulative sum of the thickness of each layer and append to x.
-        self.x = [0] * self.nz
-        layer = 0                               # NOTE: 0 indexing instead of 1
-        cum_sum = layer_thickness[layer]
-        for i in range(self.nz):
-            if (self.z[i] >= cum_sum) and (layer < len(layer_thickness)-1):
-                layer += 1
-                cum_sum = cum_sum + layer_thickness[layer]
-            self.x[i] = alloy_profile[layer]
+        # Layer j spans [cum_sum[j-1], cum_sum[j]); points past the last
+        # boundary belong to the last layer.
+        cum_sum = np.cumsum(layer_thickness)
+        layer = np.searchsorted(cum_sum[:-1], self.z, side="right")     # NOTE: 0 indexing instead of 1
+        self.x = np.asarray(alloy_profile, dtype=float)[layer]
+        self.x.setflags(write=False)
         
         self.z = self.z*ConstAndScales.ANGSTROM
         self.K = 0
         self.dE = 0.5e-3
         # self.dE = 0.005
+        self._profiles = {}     # read-only profiles, built on first use
         
     # Set methods
     def set_K(self, val):
         self.K = val
+        self._profiles.pop("V", None)       # only V depends on the bias
 
     def set_dE(self, val):
         self.dE = val
@@ -74,11 +73,19 @@ class Grid:
     def get_Vmax(self, K):
         return ConstAndScales.E *(max(self.x)*self.material.V.barr + max(self.z) * K * ConstAndScales.kVcm)
 
+    def _get_profile(self, name, build):
+        # Profiles are shared by every caller, so they are made read-only
+        if name not in self._profiles:
+            profile = np.asarray(build(), dtype=np.float64)
+            profile.setflags(write=False)
+            self._profiles[name] = profile
+        return self._profiles[name]
+
     def get_bandstructure_potential(self):      # assuming K in kV/cm
-        V = np.zeros(self.nz)
-        for i in range(self.nz):
-            V[i] = ConstAndScales.E *self.material.interpolate_parameter(self.x[i], self.material.V)
-        
+        return self._get_profile("V", self._build_bandstructure_potential)
+
+    def _build_bandstructure_potential(self):
+        V = ConstAndScales.E *self.material.interpolate_parameter(self.x, self.material.V)
         V = V - ConstAndScales.E * self.K * ConstAndScales.kVcm * self.z
         V = V - np.min(V)       # Applying bias will create negative potential, 
                                 # so we offset this so that the lowest energy is 0
@@ -86,20 +93,15 @@ class Grid:
     
     # Get effective mass profile vs z
     def get_effective_mass(self):
-        m = np.zeros(self.nz)
-        for i in range(self.nz):
-            m[i] = ConstAndScales.m0 * self.material.interpolate_parameter(self.x[i], self.material.m)
-        return m
+        return self._get_profile("meff", lambda: ConstAndScales.m0 * self.material.interpolate_parameter(self.x, self.material.m))
     
     def get_alpha_kane(self):
-        alpha = np.zeros(self.nz)
-        for i in range(self.nz):
-            alpha[i] = self.material.get_alpha_kane(self.x[i]) / ConstAndScales.E
-        return alpha
+        # Material returns float32 values; dividing before widening to float64
+        # keeps the profile identical to the per-point evaluation
+        return self._get_profile("alpha_kane", lambda: self.material.get_alpha_kane(self.x) / ConstAndScales.E)
     
     def get_alphap_ekenberg(self):
-        alphap = np.zeros(self.nz)
-        for i in range(self.nz):
-            alpha0gp, beta0gp = self.material.get_alpha0gp(self.x[i])
-            alphap[i] = alpha0gp / ConstAndScales.E    # NOTE: assumed we're using only alpha0gp here?
-        return alphap
\ No newline at end of file
+        def build():
+            alpha0gp, beta0gp = self.material.get_alpha0gp(self.x)
+            return alpha0gp / ConstAndScales.E    # NOTE: assumed we're using only alpha0gp here?
+        return self._get_profile("alphap_ekenberg", build)
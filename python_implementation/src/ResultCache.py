@@ -0,0 +1,209 @@
+#
+#   Persistent cache of solver results on disk, keyed by a hash of the
+#   solver's inputs and of the solver source code, so identical runs from the
+#   app or from scripts are only solved once. Off unless DTMM_CACHE=1 is set
+#   or set_enabled(True) is called; the Streamlit app turns it on.
+#
+
+import hashlib
+import os
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+
+# Bump when the stored format or the meaning of the inputs changes. Changes to
+# the solver code are covered by the source digest in every key.
+CACHE_VERSION = 2
+
+_enabled = os.environ.get("DTMM_CACHE", "0").lower() in ("1", "on", "true", "yes")
+_default_cache = None
+_source_digest = None
+
+
+def set_enabled(val):
+    """Turn the cache on or off for solvers created from now on. It starts
+    on when DTMM_CACHE=1 is set."""
+    global _enabled
+    _enabled = bool(val)
+
+
+def is_enabled():
+    return _enabled
+
+
+def get_default_cache():
+    """The cache new solvers use, or None when caching is turned off."""
+    return get_cache() if _enabled else None
+
+
+def get_cache():
+    """The shared cache, whether or not new solvers use it by default.
+
+    The directory is $DTMM_CACHE_DIR, or dtmm_schrodinger under
+    $XDG_CACHE_HOME (~/.cache).
+    """
+    global _default_cache
+    if _default_cache is None:
+        directory = os.environ.get("DTMM_CACHE_DIR")
+        if directory is None:
+            base = os.environ.get("XDG_CACHE_HOME", os.path.join(os.path.expanduser("~"), ".cache"))
+            directory = os.path.join(base, "dtmm_schrodinger")
+        _default_cache = ResultCache(directory)
+    return _default_cache
+
+
+def get_source_digest():
+    """Hex digest of the Python sources of the src package, so results cached
+    by a different version of the solvers are never served."""
+    global _source_digest
+    if _source_digest is None:
+        h = hashlib.sha256()
+        directory = os.path.dirname(os.path.abspath(__file__))
+        for name in sorted(os.listdir(directory)):
+            if name.endswith(".py"):
+                with open(os.path.join(directory, name), "rb") as f:
+                    h.update(name.encode() + b"\0" + f.read())
+        _source_digest = h.hexdigest()
+    return _source_digest
+
+
+def get_key(inputs):
+    """Stable hex digest of a dict of solver inputs and of the solver source.
+    Arrays are hashed by dtype, shape and contents, everything else by its
+    repr."""
+    h = hashlib.sha256(f"v{CACHE_VERSION}:{get_source_digest()}".encode())
+    for name in sorted(inputs):
+        val = inputs[name]
+        h.update(name.encode() + b"\0")
+        if isinstance(val, np.ndarray):
+            h.update(f"{val.dtype.str}{val.shape}".encode())
+            h.update(np.ascontiguousarray(val).tobytes())
+        else:
+            h.update(repr(val).encode())
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+class ResultCache:
+    """Energies and wavefunctions stored as one compressed .npz file per key.
+
+    Files are written to a temporary name and renamed into place, so readers,
+    including other processes, never see a partial file. A hit refreshes the
+    file's modification time and, once the directory grows past max_bytes,
+    the least recently used files are removed.
+    """
+
+    def __init__(self, directory, max_bytes=256*2**20):
+        """
+        Args:
+            directory (str): Cache directory, created when first written to
+            max_bytes (int): Size the directory is trimmed to after a write
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    # Set methods
+    def set_max_bytes(self, val):
+        self.max_bytes = int(val)
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        """Cached result of key.
+
+        Returns:
+            tuple | None: (energies, list of wavefunctions) or None on a miss
+        """
+        path = self.get_path(key)
+        try:
+            with np.load(path) as data:
+                energies = data["energies"]
+                psis = list(data["psis"])
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            # Unreadable, e.g. written by another version: solve again
+            self._remove(path)
+            return None
+
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return energies, psis
+
+    def get_metadata(self, key):
+        """Timing metadata stored with key, or None on a miss.
+
+        Returns:
+            dict | None: elapsed (s) of the original solve and created (Unix
+                time) of the entry
+        """
+        try:
+            with np.load(self.get_path(key)) as data:
+                return {"elapsed": float(data["elapsed"]), "created": float(data["created"])}
+        except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+            return None
+
+    def put(self, key, energies, psis, elapsed):
+        """Store a result, then trim the directory to max_bytes.
+
+        Args:
+            key (str): From get_key
+            energies (np.ndarray): Energies in J
+            psis (list): Wavefunctions, all of the same length
+            elapsed (float): Time taken by the solve, in s
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        psis = np.array(psis) if len(psis) else np.zeros((0, 0))
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, energies=np.asarray(energies), psis=psis,
+                                    elapsed=elapsed, created=time.time())
+            os.replace(tmp, self.get_path(key))
+        except BaseException:
+            self._remove(tmp)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used files until the directory holds at
+        most max_bytes."""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith(".npz"):
+                    try:
+                        stat = entry.stat()
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        """Remove every cached result."""
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name.endswith(".npz"):
+                self._remove(os.path.join(self.directory, name))
+
+    @staticmethod
+    def _remove(path):
+        # Another process may have removed it first
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
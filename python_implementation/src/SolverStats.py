@@ -0,0 +1,188 @@
+#
+#   Per-phase timings and counters recorded by the solvers when profiling is
+#   turned on, and a stand-in that records nothing when it is off.
+#
+
+import contextlib
+import contextvars
+import json
+import logging
+import os
+import time
+
+_enabled = os.environ.get("DTMM_STATS", "0").lower() in ("1", "on", "true", "yes")
+_recording = contextvars.ContextVar("dtmm_stats_recording", default=None)
+
+
+def set_enabled(val):
+    """Turn profiling on or off for solvers created from now on. It starts
+    on when DTMM_STATS=1 is set."""
+    global _enabled
+    _enabled = bool(val)
+
+
+def is_enabled():
+    return _enabled
+
+
+def new_stats():
+    """The stats of the enclosing recording block, else a fresh SolverStats
+    when profiling is on, else NULL_STATS."""
+    stats = _recording.get()
+    if stats is not None:
+        return stats
+    return SolverStats() if _enabled else NULL_STATS
+
+
+@contextlib.contextmanager
+def recording(stats=None):
+    """Context manager under which solvers created in this thread record into
+    stats from their construction on, so their "grid_profiles" phase is
+    included. set_stats on a solver only covers later solves.
+
+    Args:
+        stats (SolverStats | NullStats): Stats to record into, a fresh
+            SolverStats by default
+
+    Yields:
+        The stats recorded into
+    """
+    stats = SolverStats() if stats is None else stats
+    token = _recording.set(stats)
+    try:
+        yield stats
+    finally:
+        _recording.reset(token)
+
+
+class _Phase:
+    __slots__ = ("stats", "name", "start")
+
+    def __init__(self, stats, name):
+        self.stats = stats
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        stats, name = self.stats, self.name
+        stats.timings[name] = stats.timings.get(name, 0.0) + time.perf_counter() - self.start
+        stats.calls[name] = stats.calls.get(name, 0) + 1
+
+
+class SolverStats:
+    """Wall time per phase, counters and recorded values of one or more solves.
+
+    Phases can nest, so their times are inclusive: "solve" covers the whole
+    get_wavefunctions call and the other phases happen inside it.
+    """
+    enabled = True
+
+    def __init__(self) -> None:
+        self.timings = {}       # phase -> total time in s
+        self.calls = {}         # phase -> number of times it ran
+        self.counters = {}      # name -> count
+        self.values = {}        # name -> list of values, e.g. iterations per root
+
+    def phase(self, name):
+        """Context manager adding the time spent inside it to phase name."""
+        return _Phase(self, name)
+
+    def count(self, name, n=1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def record(self, name, values):
+        """Append values (one or a sequence) to the list kept under name."""
+        if not hasattr(values, "__len__"):
+            values = [values]
+        # Plain Python numbers, so that as_dict stays JSON serialisable
+        self.values.setdefault(name, []).extend(getattr(v, "item", lambda: v)() for v in values)
+
+    def merge(self, other):
+        """Add the timings, counters and values of other, a SolverStats or
+        the output of as_dict, to these."""
+        if isinstance(other, dict):
+            other = SolverStats.from_dict(other)
+        for name, t in other.timings.items():
+            self.timings[name] = self.timings.get(name, 0.0) + t
+        for name, n in other.calls.items():
+            self.calls[name] = self.calls.get(name, 0) + n
+        for name, n in other.counters.items():
+            self.count(name, n)
+        for name, values in other.values.items():
+            self.values.setdefault(name, []).extend(values)
+        return self
+
+    def get_time(self, phase):
+        return self.timings.get(phase, 0.0)
+
+    def as_dict(self):
+        return {"timings": dict(self.timings), "calls": dict(self.calls),
+                "counters": dict(self.counters), "values": {k: list(v) for k, v in self.values.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        stats = cls()
+        stats.timings.update(data.get("timings", {}))
+        stats.calls.update(data.get("calls", {}))
+        stats.counters.update(data.get("counters", {}))
+        stats.values.update({k: list(v) for k, v in data.get("values", {}).items()})
+        return stats
+
+    def to_json(self, path=None, **kwargs):
+        """JSON text of as_dict, also written to path when given."""
+        text = json.dumps(self.as_dict(), **kwargs)
+        if path is not None:
+            with open(path, "w") as f:
+                f.write(text)
+        return text
+
+    def log_line(self):
+        """One-line summary: phase times in ms with their call counts, then
+        the counters and the total and maximum of each recorded value."""
+        parts = [f"{name}={1e3*t:.2f}ms/{self.calls.get(name, 0)}" for name, t in self.timings.items()]
+        parts += [f"{name}={n}" for name, n in self.counters.items()]
+        parts += [f"{name}=sum:{sum(v)},max:{max(v)}" for name, v in self.values.items() if v]
+        return " ".join(parts)
+
+    def log(self, logger=None, level=logging.INFO, prefix="solver stats"):
+        (logger or logging.getLogger("dtmm")).log(level, "%s: %s", prefix, self.log_line())
+
+
+class NullStats:
+    """Stands in for SolverStats when profiling is off. Every call is a no-op,
+    so the instrumented code costs a method call per phase."""
+    enabled = False
+    _phase = contextlib.nullcontext()
+
+    def phase(self, name):
+        return self._phase
+
+    def count(self, name, n=1):
+        pass
+
+    def record(self, name, values):
+        pass
+
+    def merge(self, other):
+        return self
+
+    def get_time(self, phase):
+        return 0.0
+
+    def as_dict(self):
+        return {}
+
+    def to_json(self, path=None, **kwargs):
+        return "{}"
+
+    def log_line(self):
+        return ""
+
+    def log(self, logger=None, level=logging.INFO, prefix="solver stats"):
+        pass
+
+
+NULL_STATS = NullStats()
@@ -6,8 +6,10 @@ from src.FDMSolver import FDMSolver
 from src import ConstAndScales
 
 import scipy
+import scipy.linalg
 import numpy as np
 import scipy.sparse as sp
+import scipy.sparse.linalg as spla
 import math
 
 class Parabolic_FDM(FDMSolver): # type: ignore
@@ -15,113 +17,268 @@ class Parabolic_FDM(FDMSolver): # type: ignore
         super().__init__(Grid, nEmax)
 
     def construct_matrix(self):
-        nz = self.G.get_nz()
-        # A = np.zeros((nz, nz))
-        A = sp.lil_matrix((nz, nz))
-        scale = math.pow( (ConstAndScales.HBAR / self.G.get_dz()), 2) / 4.0
-
-        for i in range(nz-1):
-            if i != 0:
-                A[i, i-1] = -scale * (1.0/self.meff[i-1] + 1.0/self.meff[i])
-            if i != nz-1:
-                A[i, i+1] = -scale * (1.0/self.meff[i+1] + 1.0/self.meff[i])
-            if ( (i != 0) and (i != nz-1) ):
-                A[i, i] = self.V[i] + scale * (1.0/self.meff[i+1] + 2.0/self.meff[i] + 1.0/self.meff[i-1])
-        
-        A[0, 0] = A[1, 1]
-        A[nz-1, nz-1] = A[nz-2, nz-2]
-        return A.tocsr()
-        # return A
+        return self._kinetic_tridiagonal(self.meff)
+
+    def solve_eigenproblem(self):
+        """Exactly the eigenpairs inside the energy window, from a symmetric
+        tridiagonal solver.
+
+        The last row only holds its diagonal, so the last point decouples: its
+        eigenvalue is that diagonal, far above the band, and every other
+        eigenvector is zero there. The remaining block is symmetric.
+        """
+        with self.stats.phase("assembly"):
+            diag, upper = self._leading_block(self.construct_matrix())
+        Emin, Emax = self.get_energy_window()
+
+        eigenvalues, v = scipy.linalg.eigh_tridiagonal(
+            diag, upper, select="v", select_range=(Emin/ConstAndScales.meV, Emax/ConstAndScales.meV))
+
+        eigenvectors = np.zeros((len(diag)+1, len(eigenvalues)))
+        eigenvectors[:-1] = v
+        return eigenvalues*ConstAndScales.meV, eigenvectors
 
 class Kane_FDM(FDMSolver):      # type: ignore
     def __init__(self, Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
+        self.engine = "companion"
+        self.energy_tolerance = 1e-6     # meV, nonlinear engine only
+        self.max_iterations = 50
+        self.iterations = np.array([], dtype=int)
+
+    # Set methods
+    def set_engine(self, engine):
+        """Select how the energy-dependent Kane problem is solved.
+
+        Args:
+            engine (str): "companion" linearises it into the 4nz x 4nz
+                companion matrix and solves that with ARPACK. "nonlinear"
+                stays at nz: for each state it solves E = lambda_n(H(E)),
+                where H(E) is the parabolic Hamiltonian with the Kane mass
+                meff*(1 + alpha*(E - V)) and lambda_n its n-th eigenvalue.
+        """
+        if engine not in ("companion", "nonlinear"):
+            raise ValueError(f"Unknown Kane engine: {engine}")
+        self.engine = engine
+
+    def set_energy_tolerance(self, val):
+        """Energy tolerance of the nonlinear engine, in meV."""
+        self.energy_tolerance = val
+
+    def construct_matrix_at(self, E):
+        """Symmetric form of H(E), the Kane Hamiltonian at energy E in J.
+
+        H(E) is the parabolic Hamiltonian with the Kane mass
+        meff*(1 + alpha*(E - V)), discretised as the companion matrix does:
+        its rows are those of the companion's last block row divided by the
+        Kane factors of the point and its neighbours. The boundary points
+        take their own value for the missing neighbour, which leaves H(E)
+        unsymmetric in its first and last off-diagonal entries, so it is
+        returned as the similar symmetric tridiagonal S = D H D^-1.
+
+        Returns:
+            tuple: Diagonal and off-diagonal of S in meV, and 1/D, which
+                turns eigenvectors of S into those of H(E)
+        """
+        scale = math.pow(ConstAndScales.HBAR / self.G.get_dz(), 2) / 4.0
+        inv_m = 1.0 / (self.meff*(1.0 + self.alpha*(E - self.V)))
+        inv_m_plus, inv_m_minus = self._neighbours(inv_m)
+
+        diag = self.V + scale*(inv_m_plus + 2.0*inv_m + inv_m_minus)
+        upper = -scale*(inv_m[:-1] + inv_m_plus[:-1])
+        lower = -scale*(inv_m[1:] + inv_m_minus[1:])
+
+        inv_d = np.ones(len(diag))
+        inv_d[1:] = np.cumprod(np.sqrt(lower/upper))
+        return diag/ConstAndScales.meV, -np.sqrt(upper*lower)/ConstAndScales.meV, inv_d
+
+    def get_level(self, n, E):
+        """Eigenvalue number n (from 0) of H(E), in meV."""
+        self.stats.count("level_evaluations")
+        diag, off, _ = self.construct_matrix_at(E*ConstAndScales.meV)
+        return scipy.linalg.eigh_tridiagonal(diag, off, eigvals_only=True,
+                                             select="i", select_range=(n, n))[0]
+
+    def refine_level(self, n, E0):
+        """Solve E = lambda_n(H(E)) by the secant method on
+        g(E) = lambda_n(H(E)) - E, starting from the fixed-point step E0 -> lambda_n(H(E0)).
+        The heavier mass at higher E makes lambda_n decrease with E, so the root is unique.
+
+        Args:
+            n (int): Index of the state
+            E0 (float): Starting energy in meV, e.g. the parabolic eigenvalue
+
+        Returns:
+            tuple: Energy in meV and the number of iterations used
+        """
+        E1 = self.get_level(n, E0)
+        g0 = E1 - E0
+        for i in range(1, self.max_iterations+1):
+            g1 = self.get_level(n, E1) - E1
+            if abs(g1) < self.energy_tolerance or g1 == g0:
+                break
+            E0, E1, g0 = E1, E1 - g1*(E1 - E0)/(g1 - g0), g1
+
+        return E1 + g1, i
+
+    def solve_nonlinear(self):
+        """Kane eigenpairs at the native grid size, one state at a time,
+        seeded from the eigenvalues of H at the band edge (E = V, the
+        parabolic mass). The roots E_n of lambda_n(H(E)) = E rise with n, so
+        states are refined in order until one reaches the top of the window.
+
+        Returns:
+            tuple: Eigenvalues in J and eigenvectors as columns
+        """
+        Emin, Emax = (E/ConstAndScales.meV for E in self.get_energy_window())
+        nz = self.G.get_nz()
+
+        # H(V) has the parabolic mass everywhere: alpha*(E - V) = 0
+        diag0, off0, _ = self.construct_matrix_at(self.V)
+        seeds = scipy.linalg.eigh_tridiagonal(diag0, off0, eigvals_only=True,
+                                              select="v", select_range=(-np.inf, Emax))
+
+        energies, vectors, iterations = [], [], []
+        for n in range(nz):
+            if self.nE > 0 and len(energies) == self.nE:
+                break
+            if n < len(seeds):
+                seed = seeds[n]
+            else:
+                # The Kane levels lie below the parabolic ones
+                seed = scipy.linalg.eigh_tridiagonal(diag0, off0, eigvals_only=True,
+                                                     select="i", select_range=(n, n))[0]
+            E, i = self.refine_level(n, seed)
+            if E >= Emax:
+                break
+            if E <= Emin:
+                continue
+
+            diag, off, inv_d = self.construct_matrix_at(E*ConstAndScales.meV)
+            _, v = scipy.linalg.eigh_tridiagonal(diag, off, select="i", select_range=(n, n))
+            energies.append(E*ConstAndScales.meV)
+            vectors.append(v[:, 0]*inv_d)
+            iterations.append(i)
+
+        self.iterations = np.array(iterations, dtype=int)
+        self.stats.record("iterations", self.iterations)
+        eigenvectors = np.array(vectors).T if vectors else np.zeros((nz, 0))
+        return np.array(energies), eigenvectors
+
+    def solve_eigenproblem(self):
+        if self.engine == "nonlinear":
+            return self.solve_nonlinear()
+        return super().solve_eigenproblem()
 
     def construct_matrix(self):
         nz = self.G.get_nz()
-        # A = np.zeros((4*nz, 4*nz))
-        A = sp.lil_matrix((4*nz, 4*nz))
         scale = math.pow(ConstAndScales.HBAR / self.G.get_dz(), 2) / 4.0
 
-        for i in range(nz):
-            A_i = 1.0 / self.alpha[i]
-            M_i = A_i / self.meff[i]
-            V_i = self.V[i]
-
-            # Handle boundaries
-            if (i == 0) or (i == nz-1):
-                A_plus = 1.0/self.alpha[i]
-                A_minus = A_plus
-                M_plus = A_minus/self.meff[i]
-                M_minus = M_plus
-                V_plus = self.V[i]
-                V_minus = V_plus
-            else:
-                A_plus =  1.0/self.alpha[i+1]
-                A_minus = 1.0/self.alpha[i-1]
-                M_plus = A_plus/self.meff[i+1]
-                M_minus = A_minus/self.meff[i-1]
-                V_plus = self.V[i+1]
-                V_minus = self.V[i-1]
-            
-            B_minus =  A_minus*A_i
-            B_0 = A_minus*A_plus
-            B_plus = A_plus*A_i
-
-            # Add subdiagonals of A0, A1 and A2
-            if i!=0:
-                A[3*nz+i,i-1]       = -scale * (1.0-V_plus/A_plus)*(M_minus*B_plus*(1.0 - V_i/A_i) + M_i*B_0*(1.0-V_minus/A_minus)) 	# A0
-                A[3*nz+i,nz+i-1]    = -scale * (M_i*(A_minus+A_plus-V_minus-V_plus) + M_minus*(A_plus+A_i-V_i-V_plus))				    # A1
-                A[3*nz+i,2*nz+i-1]  = -scale * (M_minus+M_i)																	        # A2
-
-            # Add superdiagonals of A0, A1 and A2
-            if i!=nz-1:
-                A[3*nz+i,i+1]       = -scale * (1.0-V_minus/A_minus)*(M_plus*B_minus*(1.0 - V_i/A_i) + M_i*B_0*(1.0-V_plus/A_plus))     # A0
-                A[3*nz+i,nz+i+1]    = -scale * (M_i*(A_minus+A_plus-V_minus-V_plus)+M_plus*(A_minus+A_i-V_i-V_minus))				    # A1
-                A[3*nz+i,2*nz+i+1]  = -scale * (M_plus+M_i); 																		    # A2
-
-            # Add diagonal of A0 block
-            A[3*nz+i,i] = -scale * (V_i * (M_plus*A_minus+M_minus*A_plus) + V_minus * (M_plus*A_i+2.0*M_i*A_plus) + V_plus * (M_minus*A_i+2.0*M_i*A_minus) - M_plus*V_i*V_minus - M_minus*V_i*V_plus - 2.0*M_i*V_plus*V_minus - M_plus*B_minus - 2.0*M_i*B_0 - M_minus*B_plus) + V_i * (1.0-V_i/A_i) * (A_i*B_0 - B_plus*V_minus - B_minus*V_plus + A_i*V_minus*V_plus)
-            # Add diagonal of A1 block
-            A[3*nz+i,nz+i] = -scale * (M_plus*(V_i+V_minus-A_i-A_minus) + M_minus*(V_i+V_plus-A_i-A_plus) + 2.0*M_i*(V_minus+V_plus-A_minus-A_plus)) - V_i*V_i*(A_plus+A_minus) + V_i * (B_minus+2.0*B_0+B_plus) + V_minus*B_plus + V_plus*B_minus - V_i*V_minus*(2.0*A_plus+A_i) - V_i*V_plus*(2.0*A_minus+A_i) - A_i*V_minus*V_plus + V_i*V_i*(V_minus+V_plus) + 2.0*V_i*V_minus*V_plus - A_i*B_0
-            # Add diagonal of A2 block
-            A[3*nz+i,2*nz+i] = scale * (M_plus+2.0*M_i+M_minus) - B_plus - B_0 - B_minus + A_plus*(2.0*V_i+V_minus) + A_minus*(2.0*V_i+V_plus) + A_i*(V_i+V_minus+V_plus) - V_i*V_i - 2.0*V_i*(V_minus+V_plus) - V_minus*V_plus
-            # Add diagonal of A3 block
-            A[3*nz+i,3*nz+i] = V_plus+2.0*V_i+V_minus-A_plus-A_i-A_minus
-            
-            # Insert identity matrices
-            A[i,nz+i] = 1.0
-            A[nz+i,2*nz+i] = 1.0
-            A[2*nz+i,3*nz+i] = 1.0         
-
-        return A.tocsr()
-        # return A
+        A_i = 1.0 / self.alpha
+        M_i = A_i / self.meff
+        V_i = self.V
+        A_plus, A_minus = self._neighbours(A_i)
+        M_plus, M_minus = self._neighbours(M_i)
+        V_plus, V_minus = self._neighbours(V_i)
+
+        B_minus =  A_minus*A_i
+        B_0 = A_minus*A_plus
+        B_plus = A_plus*A_i
+
+        # Subdiagonals of A0, A1 and A2, used from row 1
+        A0_lower = -scale * (1.0-V_plus/A_plus)*(M_minus*B_plus*(1.0 - V_i/A_i) + M_i*B_0*(1.0-V_minus/A_minus))
+        A1_lower = -scale * (M_i*(A_minus+A_plus-V_minus-V_plus) + M_minus*(A_plus+A_i-V_i-V_plus))
+        A2_lower = -scale * (M_minus+M_i)
+
+        # Superdiagonals of A0, A1 and A2, used up to row nz-2
+        A0_upper = -scale * (1.0-V_minus/A_minus)*(M_plus*B_minus*(1.0 - V_i/A_i) + M_i*B_0*(1.0-V_plus/A_plus))
+        A1_upper = -scale * (M_i*(A_minus+A_plus-V_minus-V_plus)+M_plus*(A_minus+A_i-V_i-V_minus))
+        A2_upper = -scale * (M_plus+M_i)
+
+        # Diagonals of A0, A1, A2 and A3
+        A0_diag = -scale * (V_i * (M_plus*A_minus+M_minus*A_plus) + V_minus * (M_plus*A_i+2.0*M_i*A_plus) + V_plus * (M_minus*A_i+2.0*M_i*A_minus) - M_plus*V_i*V_minus - M_minus*V_i*V_plus - 2.0*M_i*V_plus*V_minus - M_plus*B_minus - 2.0*M_i*B_0 - M_minus*B_plus) + V_i * (1.0-V_i/A_i) * (A_i*B_0 - B_plus*V_minus - B_minus*V_plus + A_i*V_minus*V_plus)
+        A1_diag = -scale * (M_plus*(V_i+V_minus-A_i-A_minus) + M_minus*(V_i+V_plus-A_i-A_plus) + 2.0*M_i*(V_minus+V_plus-A_minus-A_plus)) - V_i*V_i*(A_plus+A_minus) + V_i * (B_minus+2.0*B_0+B_plus) + V_minus*B_plus + V_plus*B_minus - V_i*V_minus*(2.0*A_plus+A_i) - V_i*V_plus*(2.0*A_minus+A_i) - A_i*V_minus*V_plus + V_i*V_i*(V_minus+V_plus) + 2.0*V_i*V_minus*V_plus - A_i*B_0
+        A2_diag = scale * (M_plus+2.0*M_i+M_minus) - B_plus - B_0 - B_minus + A_plus*(2.0*V_i+V_minus) + A_minus*(2.0*V_i+V_plus) + A_i*(V_i+V_minus+V_plus) - V_i*V_i - 2.0*V_i*(V_minus+V_plus) - V_minus*V_plus
+        A3_diag = V_plus+2.0*V_i+V_minus-A_plus-A_i-A_minus
+
+        # Companion form: identity blocks above the diagonal, the coefficient
+        # blocks in the last block row
+        I = sp.identity(nz, format="csr")
+        A = sp.bmat([
+            [None, I, None, None],
+            [None, None, I, None],
+            [None, None, None, I],
+            [self._tridiagonal(A0_lower[1:], A0_diag, A0_upper[:-1]),
+             self._tridiagonal(A1_lower[1:], A1_diag, A1_upper[:-1]),
+             self._tridiagonal(A2_lower[1:], A2_diag, A2_upper[:-1]),
+             sp.diags(A3_diag, format="csr")],
+        ], format="csr")
+
+        return A
 
 class Taylor_FDM(FDMSolver):    # type: ignore
     def __init__(self, Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
+        self._shift_inverses = {}       # sigma -> factorised (A - sigma B)^-1
 
     def construct_matrix(self):
         nz = self.G.get_nz()
-        # A = np.zeros((nz, nz))
-        A = sp.lil_matrix((nz, nz))
-        B = sp.lil_matrix((nz, nz))
+        scale = math.pow(ConstAndScales.HBAR/self.G.get_dz(), 2) / 4.0
+        g = (1.0+self.alpha*self.V)/self.meff
 
+        # The end points copy the diagonal of their neighbour, as in
+        # Parabolic_FDM, so that the pencil is regular
+        lower = -scale * (g[:-1] + g[1:])
+        upper = -scale * (g[1:] + g[:-1])
+        diag = np.empty(nz)
+        diag[1:-1] = self.V[1:-1] + scale * (g[2:] + 2.0 * g[1:-1] + g[:-2])
+        diag[0] = diag[1]
+        diag[-1] = diag[-2]
+
+        return self._tridiagonal(lower, diag, upper)
+
+    def construct_overlap_matrix(self):
+        """Right-hand side B of the generalised problem A psi = E B psi that
+        the energy-dependent Taylor mass leads to."""
+        nz = self.G.get_nz()
         scale = math.pow(ConstAndScales.HBAR/self.G.get_dz(), 2) / 4.0
+        h = self.alpha / self.meff
+
+        lower = -scale * (h[1:] + h[:-1])
+        upper = -scale * (h[:-1] + h[1:])
+        diag = np.empty(nz)
+        diag[1:-1] = 1.0 + scale * (h[2:] + 2.0 * h[1:-1] + h[:-2])
+        diag[0] = diag[1]
+        diag[-1] = diag[-2]
+
+        return self._tridiagonal(lower, diag, upper)
+
+    def get_pencil(self):
+        return self.construct_matrix(), self.construct_overlap_matrix()
+
+    def get_shift_inverse(self, sigma, A=None, B=None):
+        """(A - sigma B)^-1 as a LinearOperator backed by a sparse LU
+        factorisation, kept for later solves with the same shift."""
+        if sigma not in self._shift_inverses:
+            A = self.construct_matrix() if A is None else A
+            B = self.construct_overlap_matrix() if B is None else B
+            lu = spla.splu(sp.csc_matrix(A - sigma*B))
+            self._shift_inverses[sigma] = spla.LinearOperator(A.shape, matvec=lu.solve, dtype=np.float64)
+        return self._shift_inverses[sigma]
+
+    def solve_eigenproblem(self):
+        """Eigenpairs of the symmetric pencil A psi = E B psi, so that the
+        energy-dependent mass in B is kept. B is positive definite, which
+        allows a symmetric shift-invert solve. The shift sits at the bottom of
+        the energy window, where the kept states start."""
+        with self.stats.phase("assembly"):
+            A = self.construct_matrix()
+            B = self.construct_overlap_matrix()
+        k, sigma, v0 = self.get_arpack_settings(A.shape[0], float(self.get_energy_window()[0]), trim=True)
 
-        for i in range(nz):
-            if i != 0:
-                B[i, i-1] = -scale * (self.alpha[i] / self.meff[i] + self.alpha[i-1] / self.meff[i-1])
-                A[i, i-1] = -scale * ((1.0+self.alpha[i-1] *self.V[i-1]) / self.meff[i-1] + (1.0+self.alpha[i]*self.V[i])/self.meff[i])
-            if i != nz-1:
-                B[i, i+1] = -scale * (self.alpha[i] / self.meff[i] + self.alpha[i+1] / self.meff[i+1])
-                A[i, i+1] = -scale * ((1.0+self.alpha[i+1]*self.V[i+1])/self.meff[i+1]+(1.0+self.alpha[i]*self.V[i])/self.meff[i])
-            if (i!=0) and (i!=nz-1):
-                B[i,i] = 1.0 + scale * (self.alpha[i+1] / self.meff[i+1] + 2.0 * self.alpha[i] / self.meff[i] + self.alpha[i-1] / self.meff[i-1])
-                A[i,i] = self.V[i] + scale * ((1.0+self.alpha[i+1]*self.V[i+1])/self.meff[i+1] + 2.0 * (1.0+self.alpha[i]*self.V[i])/self.meff[i] + (1.0+self.alpha[i-1]*self.V[i-1])/self.meff[i-1])
-			    
-        return A.tocsr()
-        # return A
+        eigenvalues, eigenvectors = spla.eigsh(A, k=k, M=B, sigma=sigma, which="LM", v0=v0,
+                                               OPinv=self.get_shift_inverse(sigma, A, B))
+        return eigenvalues, eigenvectors
     
 class SolverFactory:
     from src.Solvers_FDM import Parabolic_FDM, Taylor_FDM, Kane_FDM
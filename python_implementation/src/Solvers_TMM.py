@@ -13,7 +13,24 @@ from src.TMMSolver import TMMSolver
 class Parabolic_TMM(TMMSolver): # type: ignore
     def __init__(self, Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
-        self.alpha = Grid.get_alpha_kane()
+        with self.stats.phase("grid_profiles"):
+            self.alpha = Grid.get_alpha_kane()
+        self.precompute_factors()
+
+    def precompute_factors(self):
+        self.mass_factor = 2.0*self.meff/self.hbar_pow2
+        self.mass_ratio = self._get_mass_ratio()
+
+    def get_kernel(self, E):
+        E = np.asarray(E, dtype=np.float64)[..., None]
+        k = self._complex_sqrt(self.mass_factor*(self.V-E))
+        dk = -0.5*self.mass_factor / k
+
+        p, q = k[..., :-1], k[..., 1:]
+        dp, dq = dk[..., :-1], dk[..., 1:]
+        qpq = self._pad_coefficient(self.mass_ratio[1:] * p / q, 1.0)
+        dqpq = self._pad_coefficient(self.mass_ratio[1:] * (q*dp-p*dq)/(q * q), 0.0)
+        return k, dk, qpq, dqpq
     
     def get_wavevector(self, j, E):
         return np.lib.scimath.sqrt( 2.0*self.meff[j]/self.hbar_pow2*(self.V[j]-E) )
@@ -39,7 +56,28 @@ class Parabolic_TMM(TMMSolver): # type: ignore
 class Taylor_TMM(TMMSolver): # type: ignore
     def __init__(self, Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
-        self.alpha = Grid.get_alpha_kane()
+        with self.stats.phase("grid_profiles"):
+            self.alpha = Grid.get_alpha_kane()
+        self.precompute_factors()
+
+    def precompute_factors(self):
+        self.mass_factor = 2.0*self.meff/self.hbar_pow2
+        self.mass_ratio = self._get_mass_ratio()
+
+    def get_kernel(self, E):
+        E = np.asarray(E, dtype=np.float64)[..., None]
+        g = 1.0-self.alpha*(E-self.V)
+        k = self._complex_sqrt(self.mass_factor*(self.V-E)/g)
+        k_safe = np.where(abs(k) < 1e-14, 1e-14 + 0j, k)
+        dk = -0.5*self.mass_factor / k_safe / (g*g)
+
+        p, q = k[..., :-1], k[..., 1:]
+        dp, dq = dk[..., :-1], dk[..., 1:]
+        g_prev, g_j = g[..., :-1], g[..., 1:]
+        r = self.mass_ratio[1:]
+        qpq = r / g_j * g_prev * p / q
+        dqpq = r * g_prev / g_j * (q*dp-p*dq)/(q * q) + p/q * (self.alpha[1:]*r/(g_j*g_j)*g_prev - r/g_j*self.alpha[:-1])
+        return k, dk, self._pad_coefficient(qpq, 1.0), self._pad_coefficient(dqpq, 0.0)
 
     def get_wavevector(self, j, E):
         return np.lib.scimath.sqrt(2.0*self.meff[j]/self.hbar_pow2*(self.V[j]-E)/(1.0-self.alpha[j]*(E-self.V[j])))
@@ -67,7 +105,29 @@ class Taylor_TMM(TMMSolver): # type: ignore
 class Kane_TMM(TMMSolver): # type: ignore
     def __init__(self, Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
-        self.alpha = Grid.get_alpha_kane()
+        with self.stats.phase("grid_profiles"):
+            self.alpha = Grid.get_alpha_kane()
+        self.precompute_factors()
+
+    def precompute_factors(self):
+        self.mass_factor = 2.0*self.meff/self.hbar_pow2
+        self.mass_ratio = self._get_mass_ratio()
+        # Energy-independent numerator of the coefficient derivative
+        self.alpha_step = self.alpha[1:] - self.alpha[:-1] + self.alpha[1:]*self.alpha[:-1]*(self.V[1:] - self.V[:-1])
+
+    def get_kernel(self, E):
+        E = np.asarray(E, dtype=np.float64)[..., None]
+        h = 1.0+self.alpha*(E-self.V)
+        k = self._complex_sqrt(self.mass_factor*h*(self.V-E))
+        dk = -0.5*self.mass_factor / k * (1.0 + 2.0*self.alpha*(E-self.V))
+
+        p, q = k[..., :-1], k[..., 1:]
+        dp, dq = dk[..., :-1], dk[..., 1:]
+        h_prev, h_j = h[..., :-1], h[..., 1:]
+        r = self.mass_ratio[1:]
+        qpq = r * h_j / h_prev * p / q
+        dqpq = r * h_j / h_prev * (q*dp-p*dq)/(q * q) + p/q * r * self.alpha_step / (h_prev*h_prev)
+        return k, dk, self._pad_coefficient(qpq, 1.0), self._pad_coefficient(dqpq, 0.0)
 
     def get_wavevector(self, j, E):
         return np.lib.scimath.sqrt(2.0*self.meff[j]*(1.0+self.alpha[j]*(E-self.V[j]))/self.hbar_pow2*(self.V[j]-E))
@@ -95,7 +155,29 @@ class Kane_TMM(TMMSolver): # type: ignore
 class Ekenberg_TMM(TMMSolver): # type: ignore
     def __init__(self, Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
-        self.alpha = Grid.get_alphap_ekenberg()
+        with self.stats.phase("grid_profiles"):
+            self.alpha = Grid.get_alphap_ekenberg()
+        self.precompute_factors()
+
+    def precompute_factors(self):
+        self.mass_factor = self.meff/(self.hbar_pow2*self.alpha)
+        self.mass_ratio = self._get_mass_ratio()
+        self.gamma = self.hbar_pow2*self.alpha/self.meff
+
+    def get_kernel(self, E):
+        E = np.asarray(E, dtype=np.float64)[..., None]
+        root = self._complex_sqrt(1.0+4.0*self.alpha*(self.V-E))
+        k = np.sqrt(self.mass_factor*(root-1.0))
+        k_safe = np.where(abs(k) < 1e-14, 1e-14 + 0j, k)
+        dk = -self.mass_factor*self.alpha/k_safe/(1.0 + self.gamma*k_safe*k_safe)
+
+        p, q = k[..., :-1], k[..., 1:]
+        dp, dq = dk[..., :-1], dk[..., 1:]
+        g_prev, g_j = self.gamma[:-1], self.gamma[1:]
+        r = self.mass_ratio[1:]
+        qpq = r * (1.0+g_prev*p*p) / (1.0+g_j*q*q) * p / q
+        dqpq = r / (q+g_j*q*q*q) * ((1.0 + 3.0*g_prev*p*p) * dp - (1.0+g_prev*p*p) / (1.0+g_j*q*q) * p / q * (1.0 + 3.0*g_j*q*q)*dq)
+        return k, dk, self._pad_coefficient(qpq, 1.0), self._pad_coefficient(dqpq, 0.0)
     
     def get_wavevector(self, j, E):
         return np.lib.scimath.sqrt(self.meff[j]/(self.hbar_pow2*self.alpha[j]) * (np.lib.scimath.sqrt(1.0+4.0*self.alpha[j]*(self.V[j]-E))-1.0))
@@ -1,3 +1,5 @@
+import bisect
+
 import plotly.graph_objects as go
 
 class SweepVisualisation:
@@ -18,6 +20,25 @@ class SweepVisualisation:
         self.x2_vals = x2_vals
         self.typ = typ
         self.k_values = k_values or []
+        self.trace_x = None     # per-trace x values, once points are appended
+
+    def append_point(self, k_index, x, ediff, dipole, osc_strength):
+        """Add one sweep point to trace k_index, e.g. as results stream in.
+        Points may arrive in any order; each trace is kept sorted by x."""
+        if self.trace_x is None:
+            self.trace_x = [list(self.x_vals) for _ in self.ediff]
+            self.ediff, self.dipoles, self.osc_strength = (
+                [list(t) for t in traces] for traces in (self.ediff, self.dipoles, self.osc_strength))
+
+        while len(self.trace_x) <= k_index:
+            for traces in (self.trace_x, self.ediff, self.dipoles, self.osc_strength):
+                traces.append([])
+
+        pos = bisect.bisect(self.trace_x[k_index], x)
+        self.trace_x[k_index].insert(pos, x)
+        self.ediff[k_index].insert(pos, ediff)
+        self.dipoles[k_index].insert(pos, dipole)
+        self.osc_strength[k_index].insert(pos, osc_strength)
 
     def _make_fig(self, traces, y_label, title):
         fig = go.Figure()
@@ -28,7 +49,7 @@ class SweepVisualisation:
 
         for i, y in enumerate(traces):
             fig.add_trace(go.Scatter(
-                x=self.x_vals,
+                x=self.x_vals if self.trace_x is None else self.trace_x[i],
                 y=y,
                 mode='lines+markers',
                 name=f"K = {self.k_values[i]}"
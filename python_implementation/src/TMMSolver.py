@@ -4,30 +4,100 @@
 from src.BaseSolver import BaseSolver
 from src.Grid import Grid
 from src import ConstAndScales
+from src.WorkerPool import SharedArrays, get_pool
+from src import TMMKernels
+from src import SolverStats
 
 from abc import abstractmethod
 import numpy as np
 import math
-import timeit
-from concurrent.futures import ProcessPoolExecutor
+import warnings
 
-# from numba import njit
 # from scipy import optimize
 # import cmath
 
-# @njit(cache=True, fastmath=True)
-# def _matmul2x2(A, B):
-#     C = np.empty((2, 2), dtype=np.complex128)
-#     C[0,0] = A[0,0]*B[0,0] + A[0,1]*B[1,0]
-#     C[0,1] = A[0,0]*B[0,1] + A[0,1]*B[1,1]
-#     C[1,0] = A[1,0]*B[0,0] + A[1,1]*B[1,0]
-#     C[1,1] = A[1,0]*B[0,1] + A[1,1]*B[1,1]
-#     return C
-
 class TMMSolver(BaseSolver):
     def __init__(self, Grid: Grid, nEmax) -> None:
         super().__init__(Grid, nEmax)
         self.hbar_pow2 = ConstAndScales.HBAR **2
+        self.z = self.G.get_z()
+        self.nz = self.G.get_nz()
+        self.dz = self.G.get_dz()
+        self.dE = self.G.get_dE()
+        self.backend = "numpy"
+        self.reuse_matrices = False
+        self._last_matrices = None       # (E, k, M) of the last refinement step
+        self.scan_mode = "batched"
+        self.block_size = 64
+        self.chain_chunk = 4096          # grid points per step of the derivative chain
+        self.coarse_factor = 16
+        self.min_separation = None       # meV, defaults to the Grid dE
+        self.energy_tolerance = 1e-6     # meV
+        self.max_iterations = 100
+        self.iterations = np.array([], dtype=int)
+
+    # Set methods
+    def set_scan_mode(self, mode):
+        """Select how the energy range is scanned for minima of |M11|.
+
+        Args:
+            mode (str): "batched" evaluates blocks of energies at once,
+                "serial" evaluates one energy at a time and "adaptive" starts
+                from a coarse grid and only refines where a minimum is likely.
+                "nodes" brackets each bound state directly by counting the
+                nodes of the wavefunction and stops after nEmax states
+        """
+        if mode not in ("batched", "serial", "adaptive", "nodes"):
+            raise ValueError(f"Unknown scan mode: {mode}")
+        self.scan_mode = mode
+
+    def set_backend(self, backend):
+        """Select how M11, its derivative and the wavefunctions are evaluated.
+
+        Args:
+            backend (str): "numpy" for the vectorised NumPy path or "numba"
+                for the compiled kernels in TMMKernels. Falls back to "numpy"
+                with a warning when numba is not installed.
+        """
+        if backend not in ("numpy", "numba"):
+            raise ValueError(f"Unknown backend: {backend}")
+        if backend == "numba" and not TMMKernels.HAVE_NUMBA:
+            warnings.warn("numba is not installed, using the numpy backend")
+            backend = "numpy"
+        self.backend = backend
+
+    def set_reuse_matrices(self, val):
+        """Build each wavefunction from the transfer matrices of the last
+        refinement step instead of rebuilding them at the refined energy.
+
+        Saves one matrix build per state with the numpy backend. The
+        wavefunction then belongs to an energy within energy_tolerance of the
+        returned one.
+        """
+        self.reuse_matrices = bool(val)
+
+    def set_energy_tolerance(self, val):
+        """Energy tolerance of the root refinement, in meV."""
+        self.energy_tolerance = val
+
+    def set_min_separation(self, val):
+        """Smallest level separation, in meV, the adaptive scan must resolve."""
+        self.min_separation = val
+
+    def set_coarse_factor(self, val):
+        """Initial step of the adaptive scan, as a multiple of the Grid dE."""
+        self.coarse_factor = max(1, int(val))
+
+    def set_block_size(self, val):
+        """Number of energies per batched scan block. Memory use is roughly
+        block_size * nz * 200 bytes."""
+        self.block_size = max(1, int(val))
+
+    def set_chain_chunk(self, val):
+        """Number of grid points whose transfer matrices and derivatives
+        get_m11_with_derivative builds at a time. Memory for them is roughly
+        chain_chunk * 250 bytes per energy, independent of nz."""
+        self.chain_chunk = max(1, int(val))
 
     @abstractmethod
     def get_wavevector(self, j, E):
@@ -45,6 +115,177 @@ class TMMSolver(BaseSolver):
     def get_coefficient_derivative(self, j, E):
         pass
 
+    @abstractmethod
+    def precompute_factors(self):
+        """Store the energy-independent factors used by get_kernel."""
+        pass
+
+    @abstractmethod
+    def get_kernel(self, E):
+        """Vectorised counterpart of the scalar wavevector and coefficient methods.
+
+        Args:
+            E (float | np.ndarray): Energy, or array of energies, in J
+
+        Returns:
+            tuple: k, dk/dE, qpq and dqpq/dE, each of shape E.shape + (nz,).
+                Index 0 of the coefficients holds the identity values 1 and 0.
+        """
+        pass
+
+    @staticmethod
+    def _complex_sqrt(x):
+        # Same branch as np.lib.scimath.sqrt, without the per-call type dispatch
+        return np.sqrt(np.asarray(x, dtype=np.float64).astype(np.complex128))
+
+    @staticmethod
+    def _pad_coefficient(c, value):
+        # Prepend the j = 0 entry so coefficient arrays line up with the grid
+        out = np.empty(c.shape[:-1] + (c.shape[-1] + 1,), dtype=np.complex128)
+        out[..., 0] = value
+        out[..., 1:] = c
+        return out
+
+    def _get_mass_ratio(self):
+        ratio = np.ones(self.nz)
+        ratio[1:] = self.meff[1:] / self.meff[:-1]
+        return ratio
+
+    @staticmethod
+    def _matmul2x2(A, B):
+        """Stacked 2x2 products written out element-wise, several times faster
+        than np.matmul for arrays of tiny matrices."""
+        C = np.empty(np.broadcast_shapes(A.shape, B.shape), dtype=np.complex128)
+        C[...,0,0] = A[...,0,0]*B[...,0,0] + A[...,0,1]*B[...,1,0]
+        C[...,0,1] = A[...,0,0]*B[...,0,1] + A[...,0,1]*B[...,1,1]
+        C[...,1,0] = A[...,1,0]*B[...,0,0] + A[...,1,1]*B[...,1,0]
+        C[...,1,1] = A[...,1,0]*B[...,0,1] + A[...,1,1]*B[...,1,1]
+        return C
+
+    @classmethod
+    def _chain_product_dual(cls, M, dM):
+        """Forward-mode counterpart of _chain_product. Carries the pairs
+        (T, dT/dE) and combines them as (A, dA)(B, dB) = (AB, dA B + A dB)."""
+        while M.shape[-3] > 1:
+            n = M.shape[-3]
+            later, earlier = slice(1, n - n%2, 2), slice(0, n - n%2, 2)
+            A, dA = M[..., later, :, :], dM[..., later, :, :]
+            B, dB = M[..., earlier, :, :], dM[..., earlier, :, :]
+            mm = cls._matmul2x2
+            paired, dpaired = mm(A, B), mm(dA, B) + mm(A, dB)
+            if n % 2:
+                paired = np.concatenate((paired, M[..., n-1:, :, :]), axis=-3)
+                dpaired = np.concatenate((dpaired, dM[..., n-1:, :, :]), axis=-3)
+            M, dM = paired, dpaired
+        return M[..., 0, :, :], dM[..., 0, :, :]
+
+    @classmethod
+    def _chain_product(cls, M):
+        """Ordered product M[n-1] @ ... @ M[0] over axis -3, by pairwise reduction."""
+        while M.shape[-3] > 1:
+            n = M.shape[-3]
+            paired = cls._matmul2x2(M[..., 1:n - n%2:2, :, :], M[..., 0:n - n%2:2, :, :])
+            if n % 2:
+                paired = np.concatenate((paired, M[..., n-1:, :, :]), axis=-3)
+            M = paired
+        return M[..., 0, :, :]
+
+    def get_transfer_matrices(self, E):
+        """Build every transfer matrix M_j at once, with M_0 the identity.
+
+        Args:
+            E (float | np.ndarray): Energy, or array of energies, in J
+
+        Returns:
+            np.ndarray: Complex array of shape E.shape + (nz, 2, 2)
+        """
+        k, _, qpq, _ = self.get_kernel(E)
+        return self._build_matrices(k, qpq)
+
+    def _build_matrices(self, k, qpq):
+        p, q, c = k[..., :-1], k[..., 1:], qpq[..., 1:]
+        zj = self.z[1:]
+
+        M = np.empty(k.shape + (2, 2), dtype=np.complex128)
+        M[..., 0, :, :] = np.identity(2)
+        M[..., 1:, 0, 0] = 0.5*(1+c)*np.exp((p-q)*zj)
+        M[..., 1:, 0, 1] = 0.5*(1-c)*np.exp(-(p+q)*zj)
+        M[..., 1:, 1, 0] = 0.5*(1-c)*np.exp((p+q)*zj)
+        M[..., 1:, 1, 1] = 0.5*(1+c)*np.exp(-(p-q)*zj)
+        return M
+
+    @classmethod
+    def _cumulative_product(cls, M):
+        """Prefix products P_j = M[j] @ ... @ M[0] over axis -3, as a
+        Hillis-Steele scan of log2(nz) stacked products."""
+        P = M.copy()
+        n = P.shape[-3]
+        shift = 1
+        while shift < n:
+            P[..., shift:, :, :] = cls._matmul2x2(P[..., shift:, :, :], P[..., :-shift, :, :])
+            shift *= 2
+        return P
+
+    def get_coefficient_vectors(self, E):
+        """Cumulative coefficients (A_j, B_j) of the solution that starts as
+        (1, 0) at the left boundary.
+
+        Returns:
+            tuple: k of shape E.shape + (nz,) and (A_j, B_j) of shape
+                E.shape + (nz, 2)
+        """
+        k, _, qpq, _ = self.get_kernel(E)
+        P = self._cumulative_product(self._build_matrices(k, qpq))
+        return k, P[..., 0]
+
+    def _evaluate_wavefunction(self, k, AB):
+        qjzj = k * self.z
+        return np.real(AB[..., 0]*np.exp(qjzj) + AB[..., 1]*np.exp(-qjzj))
+
+    def count_nodes(self, energies):
+        """Number of sign changes of the solution started from the left
+        boundary, for each energy. Below the band edges at both ends of the
+        structure this is the number of bound states below that energy."""
+        counts = np.empty(len(energies), dtype=int)
+        for start in range(0, len(energies), self.block_size):
+            block = slice(start, start + self.block_size)
+            psi = self._evaluate_wavefunction(*self.get_coefficient_vectors(energies[block]))
+            counts[block] = np.count_nonzero(np.diff(np.signbit(psi), axis=-1), axis=-1)
+        return counts
+
+    def get_transfer_matrices_with_derivative(self, E):
+        """Transfer matrices M_j and their energy derivatives dM_j/dE.
+
+        Returns:
+            tuple: M and dM, each of shape E.shape + (nz, 2, 2). M_0 is the
+                identity and dM_0 is zero.
+        """
+        return self._build_matrices_with_derivative(*self.get_kernel(E))
+
+    def _build_matrices_with_derivative(self, k, dk, qpq, dqpq, z=None):
+        # z defaults to the whole grid; with slices of the kernel and of z
+        # starting at j - 1 the first matrix is a stand-in identity
+        p, q, c = k[..., :-1], k[..., 1:], qpq[..., 1:]
+        dp, dq, dc = dk[..., :-1], dk[..., 1:], dqpq[..., 1:]
+        zj = (self.z if z is None else z)[1:]
+
+        e00, e01 = np.exp((p-q)*zj), np.exp(-(p+q)*zj)
+        e10, e11 = np.exp((p+q)*zj), np.exp(-(p-q)*zj)
+
+        M = np.empty(k.shape + (2, 2), dtype=np.complex128)
+        M[..., 0, :, :] = np.identity(2)
+        M[..., 1:, 0, 0] = 0.5*(1+c)*e00
+        M[..., 1:, 0, 1] = 0.5*(1-c)*e01
+        M[..., 1:, 1, 0] = 0.5*(1-c)*e10
+        M[..., 1:, 1, 1] = 0.5*(1+c)*e11
+
+        dM = np.zeros(k.shape + (2, 2), dtype=np.complex128)
+        dM[..., 1:, 0, 0] = 0.5*( dc + (1.0+c)*zj*(dp-dq))*e00
+        dM[..., 1:, 0, 1] = 0.5*(-dc - (1.0-c)*zj*(dp+dq))*e01
+        dM[..., 1:, 1, 0] = 0.5*(-dc + (1.0-c)*zj*(dp+dq))*e10
+        dM[..., 1:, 1, 1] = 0.5*( dc - (1.0+c)*zj*(dp-dq))*e11
+        return M, dM
+
     def get_matrix_j(self, j, E):
         if j == 0:
             return np.identity(2, dtype=np.complex128)
@@ -52,7 +293,7 @@ class TMMSolver(BaseSolver):
         p = self.get_wavevector(j-1,E)
         q = self.get_wavevector(j,E)
         qpq = self.get_coefficient(j,E)
-        zj = self.G.get_zj(j)
+        zj = self.z[j]
 
         Mj = np.empty((2,2), dtype=np.complex128)
         Mj[0,0]=0.5*(1+qpq)*np.exp((p-q)*zj)  # type: ignore
@@ -71,7 +312,7 @@ class TMMSolver(BaseSolver):
             dq = self.get_wavevector_derivative(j,E)
             qpq=self.get_coefficient(j,E)
             dqpq=self.get_coefficient_derivative(j,E)
-            zj = self.G.get_zj(j)
+            zj = self.z[j]
             dMj[0,0]= 0.5*( dqpq + (1.0+qpq)*zj*(dp-dq))*np.exp((p-q)*zj)  # type: ignore
             dMj[0,1]= 0.5*(-dqpq - (1.0-qpq)*zj*(dp+dq))*np.exp(-(p+q)*zj) # type: ignore
             dMj[1,0]= 0.5*(-dqpq + (1.0-qpq)*zj*(dp+dq))*np.exp((p+q)*zj)  # type: ignore
@@ -79,114 +320,171 @@ class TMMSolver(BaseSolver):
         
         return dMj
 
-    def get_left_TMM_cumulative_sum(self, E):
-        nz=self.G.get_nz()
-        TM_left = np.zeros((2, 2, nz), dtype=complex)
-        TM_left[:,:,0]=np.identity(2, dtype=complex)
-        for j in range(1, nz):
-            Mj=self.get_matrix_j(j,E)
-            TM_left[:,:,j]= Mj @ TM_left[:,:,j-1]
-
-        return TM_left
-    
-    def get_right_TMM_cumulative_sum(self, E):
-        nz = self.G.get_nz()
-        TM_right = np.zeros((2, 2, nz), dtype=complex)
-        TM_right[:,:,nz-1] = self.get_matrix_j(nz-1, E)
-
-        for j in range(nz-2, 0, -1):
-            Mj = self.get_matrix_j(j, E)
-            TM_right[:,:,j] = TM_right[:,:,j+1] @ Mj
-        
-        TM_right[:,:,0] = TM_right[:,:,1]
-        return TM_right
-
     def get_m11(self, E):
-        nz = self.G.get_nz()
-        TM = np.identity(2, dtype=complex)
-        for j in range(1, nz):
-            Mj = self.get_matrix_j(j, E)
-            TM = Mj @ TM
-        m11=abs(TM[0,0])
+        self.stats.count("m11_calls")
+        self.stats.count("m11_energies", np.size(E))
+        if self.backend == "numba":
+            k, _, qpq, _ = self.get_kernel(E)
+            m11 = TMMKernels.m11_product(k.reshape(-1, self.nz), qpq.reshape(-1, self.nz), self.z)
+            return abs(m11.reshape(np.shape(E)))
+
+        TM = self._chain_product(self.get_transfer_matrices(E))
+        m11 = abs(TM[..., 0, 0])
 
         return m11
     
+    def get_m11_with_derivative(self, E):
+        """Complex M11 and dM11/dE from a single forward-mode pass over the grid.
+
+        The numpy path streams the grid in chunks of chain_chunk points,
+        carrying the running pair (T, dT/dE), so only the kernel arrays grow
+        with nz and the transfer matrices of a chunk are freed before the next.
+        """
+        self.stats.count("m11_derivative_calls")
+        self.stats.count("m11_energies", np.size(E))
+        if self.backend == "numba":
+            m11, dm11 = TMMKernels.m11_with_derivative(*(a.reshape(-1, self.nz) for a in self.get_kernel(E)), self.z)
+            return m11.reshape(np.shape(E)), dm11.reshape(np.shape(E))
+
+        kernel = self.get_kernel(E)
+        TM = dTM = None
+        for start in range(1, self.nz, self.chain_chunk):
+            chunk = slice(start-1, min(start + self.chain_chunk, self.nz))
+            M, dM = self._build_matrices_with_derivative(*(a[..., chunk] for a in kernel), self.z[chunk])
+            T, dT = self._chain_product_dual(M, dM)
+            if TM is None:
+                TM, dTM = T, dT
+            else:
+                mm = self._matmul2x2
+                TM, dTM = mm(T, TM), mm(dT, TM) + mm(T, dTM)
+        return TM[..., 0, 0], dTM[..., 0, 0]
+
     def get_m11_derivative(self, E):
-        nz = self.G.get_nz()
-        dTM = np.zeros((2, 2), dtype=complex)
-        TM_left = self.get_left_TMM_cumulative_sum(E)
-        TM_right = self.get_right_TMM_cumulative_sum(E)
-        
-        for j in range(1, nz-1):
-            dMj = self.get_matrix_derivative_j(j, E)
-            A = TM_right[:,:,j+1]
-            B = TM_left[:,:,j-1]
-            dTM += A @ dMj @ B
-
-        dTM += self.get_matrix_derivative_j(nz-1, E) @ TM_left[:,:,nz-2]
-        m11 = TM_left[0,0,nz-1]
-        dTM11 = dTM[0,0]
+        m11, dTM11 = self.get_m11_with_derivative(E)
         dm11 = 1/abs(m11) * ( dTM11.real*m11.real + dTM11.imag*m11.imag )
 
         return dm11
 
     def get_wavefunction(self, E):
-        nz = self.G.get_nz()
-        A1B1 = np.zeros((2,1), dtype=complex)
-        A1B1[0,0] = 1.0
-        psi = np.zeros(nz, dtype=complex)
+        """Normalised wavefunction at energy E, started as (1, 0) at the left
+        boundary. The cumulative coefficients (A_j, B_j) are built for the
+        whole grid at once and psi evaluated as a single array expression."""
+        with self.stats.phase("wavefunctions"):
+            return self._get_wavefunction(E)
 
-        psi[0] = 1.0
-        for j in range(1, nz):
-            qjzj = self.get_wavevector(j, E) * self.G.get_zj(j)
-            Mj = self.get_matrix_j(j, E)
+    def _get_wavefunction(self, E):
+        reused = self._get_reusable_matrices(E)
+        if reused is not None:
+            k, M = reused
+            psi = self._evaluate_wavefunction(k, self._cumulative_product(M)[..., 0])
+        elif self.backend == "numba":
+            k, _, qpq, _ = self.get_kernel(E)
+            psi = TMMKernels.wavefunction(k, qpq, self.z)
+        else:
+            psi = self._evaluate_wavefunction(*self.get_coefficient_vectors(E))
 
-            A1B1 = Mj @ A1B1
-            psi[j] = np.real( A1B1[0,0]*np.exp(qjzj) + A1B1[1,0]*np.exp(-qjzj) )        
-        
-        norm_const = math.sqrt(1/np.trapezoid(np.power(abs(psi), 2))/ self.G.get_dz()*ConstAndScales.ANGSTROM)
+        psi = psi.astype(complex)
+        psi[0] = 1.0
+        norm_const = math.sqrt(1/np.trapezoid(np.power(abs(psi), 2))/ self.dz*ConstAndScales.ANGSTROM)
         psi *= norm_const
-        # print(np.trapezoid(abs(psi)**2))
 
         return psi
-    
-    def bisect(self,f,Elo,Ehi,tol):
-        a=Elo
-        b=Ehi
-        fa = f(a)
-        for i in range(40):
-            Ex=(a+b)/2
-            fx=f(Ex)
-            if abs(fx)<tol:
-                break
-            if (fx*fa<0):
-                b=Ex
+
+    def _get_reusable_matrices(self, E):
+        if not self.reuse_matrices or self._last_matrices is None:
+            return None
+        E_last, k, M = self._last_matrices
+        if abs(E - E_last) > self.energy_tolerance * ConstAndScales.meV:
+            return None
+        return k, M
+
+    def _refinement_step(self, E):
+        # M11 and dM11/dE at E, keeping the matrices for get_wavefunction
+        # when they are to be reused
+        if not self.reuse_matrices or self.backend != "numpy":
+            return self.get_m11_with_derivative(E)
+        kernel = self.get_kernel(E)
+        M, dM = self._build_matrices_with_derivative(*kernel)
+        TM, dTM = self._chain_product_dual(M, dM)
+        self._last_matrices = (E, kernel[0], M)
+        return TM[0, 0], dTM[0, 0]
+
+    def refine_root(self, Elo, Ehi):
+        """Locate the minimum of |M11| inside a scan bracket.
+
+        Takes Gauss-Newton steps on the complex M11, which converge
+        quadratically onto a zero of M11, and falls back to bisection on the
+        sign of d|M11|/dE whenever a step leaves the bracket or stops halving.
+        A bracket without a minimum inside makes the search run into one of
+        its ends, or stall on a NaN M11; such a result is rejected.
+
+        Args:
+            Elo (float): Lower end of the bracket in J
+            Ehi (float): Upper end of the bracket in J
+
+        Returns:
+            tuple: Refined energy in J, or None when the bracket holds no
+                minimum, and the number of iterations used
+        """
+        tol = self.energy_tolerance * ConstAndScales.meV
+        a, b = Elo, Ehi
+        Ex = 0.5*(a+b)
+        dx_old = b-a
+        for i in range(1, self.max_iterations+1):
+            # Off the values of V, where dM11/dE is singular and the step
+            # would stall, e.g. at the midpoint of a bracket
+            Ex = float(self._avoid_profile_values(Ex, tol))
+            m11, dm11 = self._refinement_step(Ex)
+            slope = (m11.conjugate()*dm11).real
+            if slope < 0:
+                a = Ex
             else:
-                a=Ex
-        return Ex
+                b = Ex
+
+            dx = -slope / abs(dm11)**2
+            if not (a < Ex+dx < b) or abs(dx) > 0.5*abs(dx_old):
+                dx = 0.5*(a+b) - Ex
+            dx_old = dx
+            Ex = Ex + dx
+            if abs(dx) < tol or b-a < tol:
+                break
+
+        if not np.isfinite(slope) or min(Ex - Elo, Ehi - Ex) < tol:
+            return None, i
+        return Ex, i
 
     def _solve_root(self, args):
         Elo, Ehi = args
-        f = self.get_m11_derivative
-        Ex = self.bisect(f, Elo, Ehi, 1e-8)
-        psi = self.get_wavefunction(Ex)
-        return Ex, psi
+        Ex, iterations = self.refine_root(Elo, Ehi)
+        psi = None if Ex is None else self.get_wavefunction(Ex)
+        return Ex, psi, iterations
+
+    def get_scan_energies(self, Emin=None, Emax=None):
+        """Energies from Emin to Emax in steps of the Grid dE, kept off the
+        values of V, where M11 is NaN and would hide a minimum next to it."""
+        dE = self.G.get_dE()
+        if Emin is None:
+            Emin = min(self.V) + dE
+        if Emax is None:
+            Emax = max(self.V-5*dE)
+        return self._avoid_profile_values(np.arange(Emin, Emax, dE))
 
-    def get_wavefunctions(self):
+    def scan_serial(self):
         found = 0
-        energies = []
-        psis = []
         dE = self.G.get_dE()
         Emax = max(self.V-5*dE)
         E = min(self.V) + 3*dE
-        m11_km1 = self.get_m11(E-dE)
-        m11_km2 = self.get_m11(E-2*dE)
+        # Evaluated off the values of V, as in get_scan_energies
+        get_m11 = lambda E: self.get_m11(self._avoid_profile_values(E))
+        m11_km1 = get_m11(E-dE)
+        m11_km2 = get_m11(E-2*dE)
 
         tasks = []
         while E<Emax:
-            m11_k = self.get_m11(E)
+            m11_k = get_m11(E)
             if ((m11_k>m11_km1) and (m11_km1<m11_km2)):
                 tasks.append((E-2*dE, E))
+                found += 1
 
             m11_km2 = m11_km1
             m11_km1 = m11_k
@@ -194,10 +492,256 @@ class TMMSolver(BaseSolver):
             if self.nE>0 and found == self.nE:
                 break
 
-        with ProcessPoolExecutor() as ex:
-            results = list(ex.map(self._solve_root, tasks))
+        return tasks
+
+    def scan_batched(self, Emin=None, Emax=None):
+        """Evaluate |M11| over the scan energies in blocks of block_size and
+        bracket every local minimum by its two neighbours. Stops after the
+        block in which nEmax minima have been found."""
+        energies = self.get_scan_energies(Emin, Emax)
+        if len(energies) < 3:
+            return []
+        m11 = np.empty(len(energies))
+        for start in range(0, len(energies), self.block_size):
+            block = slice(start, start + self.block_size)
+            m11[block] = self.get_m11(energies[block])
+
+            end = min(start + self.block_size, len(energies))
+            is_min = (m11[1:end-1] < m11[:end-2]) & (m11[1:end-1] < m11[2:end])
+            if self.nE>0 and np.count_nonzero(is_min) >= self.nE:
+                break
+
+        idx = np.flatnonzero(is_min) + 1
+        return [(energies[i-1], energies[i+1]) for i in idx]
+
+    def scan_nodes(self):
+        """Bracket the bound states in order by counting wavefunction nodes.
+
+        The node count is a staircase in energy that steps by one at every
+        bound state, so intervals are halved only while they hold more than
+        one step or are wider than the Grid dE, and only for the first nEmax
+        states. This holds below the band edges at both ends of the
+        structure; if fewer than nEmax states lie there, the rest of the
+        range, if any, is scanned in batched mode.
+        """
+        dE = self.G.get_dE()
+        tol = self.energy_tolerance * ConstAndScales.meV
+        nmax = self.nE if self.nE>0 else np.inf
+        Emin = min(self.V) + dE
+        Ebound = min(self.V[0], self.V[-1], max(self.V-5*dE))
+
+        tasks = []
+        if Ebound > Emin:
+            # End strictly below the band edge and keep off the values of V,
+            # where the wavefunction is NaN and the node count takes a false step
+            energies = self._avoid_profile_values(np.linspace(Emin, Ebound - 1e-2*dE, 8))
+            counts = self.count_nodes(energies)
+
+            while True:
+                width = np.diff(energies)
+                steps = np.diff(counts)
+                wanted = counts[:-1] < nmax
+                split = wanted & (((steps == 1) & (width > dE)) | ((steps > 1) & (width > tol)))
+                if not np.any(split):
+                    break
+
+                idx = np.flatnonzero(split)
+                midpoints = 0.5*(energies[idx] + energies[idx+1])
+                nudged = self._avoid_profile_values(midpoints)
+                midpoints = np.where(nudged < energies[idx+1], nudged, midpoints)
+                energies = np.insert(energies, idx+1, midpoints)
+                counts = np.insert(counts, idx+1, self.count_nodes(midpoints))
+
+            # Near the band edge the count steps where the last node leaves
+            # the grid, a little away from the level, so brackets are widened
+            # to the 2 dE of batched mode
+            idx = np.flatnonzero((np.diff(counts) > 0) & (counts[:-1] < nmax))
+            centres = 0.5*(energies[idx] + energies[idx+1])
+            lower = np.maximum(np.minimum(energies[idx], centres - dE), Emin)
+            upper = np.maximum(energies[idx+1], centres + dE)
+            tasks = list(zip(lower, upper))
+
+        if len(tasks) < nmax and Ebound < max(self.V-5*dE):
+            tasks += self.scan_batched(Emin=max(Ebound, Emin))
 
-        energies, psis = zip(*results)
+        return tasks
+
+    def get_m11_log_derivative(self, energies):
+        """log|M11| and dM11/dE / M11, evaluated in blocks of block_size. The
+        real part of the latter is the slope of log|M11| and its modulus grows
+        as the inverse distance to the nearest zero of M11."""
+        log_m11 = np.empty(len(energies))
+        w = np.empty(len(energies), dtype=np.complex128)
+        for start in range(0, len(energies), self.block_size):
+            block = slice(start, start + self.block_size)
+            m11, dm11 = self.get_m11_with_derivative(energies[block])
+            log_m11[block] = np.log(abs(m11))
+            w[block] = dm11 / m11
+        return log_m11, w
+
+    def _avoid_profile_values(self, energies, shift=None):
+        """Nudge energies within shift (default 1e-3 of the Grid dE) of a
+        value of V up by twice shift. There k = 0 and the kernel evaluates to
+        NaN and its derivatives are singular, although M11 itself is smooth."""
+        levels = np.unique(self.V)
+        idx = np.clip(np.searchsorted(levels, energies), 1, len(levels)-1)
+        distance = np.minimum(abs(energies - levels[idx-1]), abs(energies - levels[idx]))
+        if shift is None:
+            shift = 1e-3*self.dE
+        return np.where(distance < shift, energies + 2*shift, energies)
+
+    def scan_adaptive(self):
+        """Coarse-to-fine scan of M11.
+
+        Starts from a grid coarse_factor times wider than the Grid dE. Near a
+        zero E0 of M11, E - M11/(dM11/dE) estimates E0 from a single sample.
+        An interval is halved while the estimate from either end falls inside
+        it, unless the slope of log|M11| changes sign across it and both ends
+        agree on a single zero, in position and in the ratio of |M11| at the
+        ends. Any other interval is halved while log|M11| across it departs
+        from that of a single zero. Intervals stop splitting below half of
+        min_separation, so levels at least min_separation apart end up in
+        separate brackets. Minima within a Grid dE of the top of the range are
+        dropped, as batched mode has no sample above them to bracket them.
+
+        Each sample also carries dM11/dE, which costs about twice a plain
+        M11 evaluation, and the whole range is scanned whatever nEmax. On the
+        test structures at dz = 1 with nEmax = 0 this takes 3.5 times fewer
+        samples than batched mode on Structure2 (319 vs 1184) and Structure3
+        (240 vs 844) and about 1.4 times less time. On Structure1, whose range
+        is only 231 Grid steps wide, it takes 20 % more samples and about
+        twice the time, and with nEmax = 10 batched mode, which stops early,
+        is as fast or faster on all three.
+        """
+        dE = self.G.get_dE()
+        min_separation = self.G.dE*1e3 if self.min_separation is None else self.min_separation
+        width_min = 0.5 * min_separation * ConstAndScales.meV
+
+        Emin = min(self.V) + dE
+        Emax = max(self.V-5*dE)
+        energies = self._avoid_profile_values(np.append(np.arange(Emin, Emax, self.coarse_factor*dE), Emax))
+        f, w = self.get_m11_log_derivative(energies)
+
+        while True:
+            a, b = energies[:-1], energies[1:]
+            ga, gb = w[:-1].real, w[1:].real
+            with np.errstate(divide="ignore", invalid="ignore"):
+                zero = energies - (1/w).real
+                za, zb = zero[:-1], zero[1:]
+                zm = 0.5*(za + zb)
+                ratio = f[:-1] - f[1:] - np.log(abs(a - zm)/abs(b - zm))
+                minimum = (ga < 0) & (gb > 0)
+                maximum = (ga > 0) & (gb < 0)
+                isolated = (abs(za - zb) < 0.5*width_min) & (abs(ratio) < 0.1)
+                near_zero = (b-a)*np.maximum(abs(w[:-1]), abs(w[1:])) > 1.0
+                inside = ((a < za) & (za < b)) | ((a < zb) & (zb < b))
+                # Pairs of zeros between two samples leave the slope at both
+                # ends alone but not the change of log|M11| across them
+                single = abs(ratio) < 1.0
+            unresolved = ~np.isfinite(zero[:-1]) | ~np.isfinite(zero[1:])
+            suspect = np.where(minimum, ~isolated, np.where(maximum, near_zero, inside | ~single))
+            split = (b-a > width_min) & (suspect | unresolved)
+            if not np.any(split):
+                break
+
+            idx = np.flatnonzero(split)
+            midpoints = self._avoid_profile_values(0.5*(energies[idx] + energies[idx+1]))
+            f_mid, w_mid = self.get_m11_log_derivative(midpoints)
+            energies = np.insert(energies, idx+1, midpoints)
+            f = np.insert(f, idx+1, f_mid)
+            w = np.insert(w, idx+1, w_mid)
+
+        idx = np.flatnonzero((w[:-1].real < 0) & (w[1:].real > 0) & (energies[1:] < Emax - dE))
+        return [(energies[i], energies[i+1]) for i in idx]
+
+    def compute_wavefunctions(self):
+        with self.stats.phase("scan"):
+            if self.scan_mode == "serial":
+                tasks = self.scan_serial()
+            elif self.scan_mode == "adaptive":
+                tasks = self.scan_adaptive()
+            elif self.scan_mode == "nodes":
+                tasks = self.scan_nodes()
+            else:
+                tasks = self.scan_batched()
+
+        # Refinement includes the wavefunctions, which pool workers build
+        # without recording them. Brackets rejected by refine_root are
+        # replaced by the next ones until nEmax states are found.
+        results = []
+        with self.stats.phase("refine"):
+            while tasks and (self.nE <= 0 or len(results) < self.nE):
+                n = len(tasks) if self.nE <= 0 else self.nE - len(results)
+                batch, tasks = tasks[:n], tasks[n:]
+                if self.parallel and len(batch) > 1:
+                    refined = self._solve_roots_shared(batch)
+                else:
+                    refined = [self._solve_root(bracket) for bracket in batch]
+                accepted = [r for r in refined if r[0] is not None]
+                self.stats.count("rejected_brackets", len(refined) - len(accepted))
+                results += accepted
+
+        if not results:
+            self.iterations = np.array([], dtype=int)
+            return np.array([]), []
+
+        energies, psis, iterations = zip(*results)
+        self.iterations = np.array(iterations)
+        self.stats.count("states", len(energies))
+        self.stats.record("iterations", self.iterations)
         return np.array(energies), list(psis)
-                
 
+    def get_profiles(self):
+        """Grid arrays a solver needs to refine roots and build wavefunctions."""
+        return {"z": self.z, "V": self.V, "meff": self.meff, "alpha": self.alpha}
+
+    def get_settings(self):
+        """Scalar solver settings, without the Grid, arrays or private state."""
+        return {key: val for key, val in vars(self).items()
+                if key not in ("G", "cache", "stats") and not key.startswith("_") and not isinstance(val, np.ndarray)}
+
+    @classmethod
+    def from_profiles(cls, profiles, settings):
+        """Rebuild a solver from get_profiles and get_settings output, without
+        a Grid. It can refine roots and build wavefunctions but not scan."""
+        solver = cls.__new__(cls)
+        solver.__dict__.update(settings)
+        solver.__dict__.update(profiles)
+        solver.G = None
+        solver.cache = None
+        solver.stats = SolverStats.NULL_STATS
+        solver._last_matrices = None
+        solver.precompute_factors()
+        return solver
+
+    def _solve_roots_shared(self, tasks):
+        # Profiles go to the workers once per call through shared memory and
+        # the wavefunctions come back the same way; only brackets, energies
+        # and iteration counts are pickled.
+        settings = self.get_settings()
+        with SharedArrays(self.get_profiles()) as profiles, \
+             SharedArrays({"psi": np.zeros((len(tasks), self.nz), dtype=complex)}) as output:
+            futures = [get_pool().submit(_solve_root_shared, type(self), profiles, settings, output, i, bracket)
+                       for i, bracket in enumerate(tasks)]
+            roots = [f.result() for f in futures]
+            psis = output["psi"].copy()
+
+        return [(Ex, psi, iterations) for (Ex, iterations), psi in zip(roots, psis)]
+
+
+# Solver rebuilt by a pool worker, kept while its profiles block is in use
+_worker_solver = (None, None)
+
+
+def _solve_root_shared(cls, profiles, settings, output, index, bracket):
+    global _worker_solver
+    key = (cls, profiles.name)
+    if _worker_solver[0] != key:
+        _worker_solver = (None, None)
+        _worker_solver = (key, cls.from_profiles(profiles.attach(), settings))
+    solver = _worker_solver[1]
+
+    Ex, iterations = solver.refine_root(*bracket)
+    if Ex is not None:
+        output["psi"][index] = solver.get_wavefunction(Ex)
+    return Ex, iterations
@@ -13,21 +13,19 @@ class TransitionCalculator:
             return None
         else:
             return energies[i-1] - energies[j-1]
+
+    def get_weights(self, z):
+        # Trapezoid rule on the uniform grid z
+        dz = z[1] - z[0]
+        w = np.full(len(z), dz)
+        w[[0, -1]] = dz/2
+        return w
     
     def get_dipole(self, z, psis, i, j):
         if len(psis) < max(i, j):
             return None
 
-        psi_i = psis[i-1]
-        psi_j = psis[j-1]
-
-        dz = z[1] - z[0]
-        
-        integral=0
-        integrand = psi_i * z * psi_j
-        for iz in range(1,len(z)):
-            integral+= dz * (integrand[iz-1]+integrand[iz])/2
-        
+        integral = np.dot(self.get_weights(z) * z * psis[i-1], psis[j-1])
         return abs(integral) / self.A
     
     def get_oscillator_strength(self, z, energies, psis, i,j):
@@ -35,13 +33,44 @@ class TransitionCalculator:
         if e_ij is None:
             return None
         else:
-            d_ij = self.get_dipole(z, psis, i,j) * self.A # type: ignore
+            d_ij = self.get_dipole(z, psis, i,j)
             if d_ij is None:
                 return None
-            return (2*self.m_e / self.hbar**2) * e_ij * abs(d_ij)**2
+            return self.oscillator_strength(e_ij, d_ij)
+
+    def oscillator_strength(self, e_ij, d_ij):
+        """Oscillator strength from an energy difference in J and a dipole in Å.
+        Works elementwise on arrays."""
+        return (2*self.m_e / self.hbar**2) * e_ij * abs(d_ij * self.A)**2
+
+    def get_transition_matrices(self, z, energies, psis):
+        """Energy differences, dipoles and oscillator strengths of every pair
+        of states. Element [i-1, j-1] of each matrix is the value calculate
+        returns for levels i and j.
+
+        The dipoles come from one weighted product Psi diag(w z) Psi^T, with
+        w the trapezoid weights of z.
+
+        Args:
+            z (np.ndarray): Grid positions
+            energies (np.ndarray): State energies in J
+            psis (list): Wavefunctions on z, one per energy
+
+        Returns:
+            tuple: (ediff, dipoles, osc_strength), each of shape (n, n) for
+                n states
+        """
+        energies = np.asarray(energies)
+        psi = np.asarray(psis).reshape(len(energies), len(z))
+
+        ediff = energies[:, None] - energies[None, :]
+        dipoles = abs(psi @ ((self.get_weights(z) * z)[:, None] * psi.T)) / self.A
+        return ediff, dipoles, self.oscillator_strength(ediff, dipoles)
     
     def calculate(self, z, energies, psis, i,j):
         e21 = self.get_energy_diff(energies, i,j)
         d21 = self.get_dipole(z, psis, i,j)
-        f21 = self.get_oscillator_strength(z, energies, psis, i,j)
-        return e21, d21, f21
\ No newline at end of file
+        if e21 is None or d21 is None:
+            return e21, d21, None
+        f21 = self.oscillator_strength(e21, d21)
+        return e21, d21, f21
@@ -0,0 +1,224 @@
+#
+#   Headless sweep of a transition (energy difference, dipole and oscillator
+#   strength between two levels) over bias, barrier molar content and well
+#   width. Used by the Streamlit transition page and usable from scripts.
+#
+
+from concurrent.futures import as_completed
+from dataclasses import dataclass, field
+import math
+import os
+
+import numpy as np
+
+from src import ConstAndScales
+from src import SolverStats
+from src.Composition import Composition
+from src.Grid import Grid
+from src.Material import Material
+from src.Solvers_FDM import SolverFactory
+from src.TransitionCalculator import TransitionCalculator
+from src.WorkerPool import get_pool
+
+
+@dataclass
+class SweepResult:
+    """Sweep outputs of shape (nK, nh, nw), NaN where the structure has fewer
+    than max(i, j) levels. Units are those of TransitionCalculator."""
+    K_values: np.ndarray            # kV/cm
+    heights: np.ndarray             # barrier molar content
+    widths: np.ndarray              # well width in Å
+    barrier_heights: np.ndarray     # conduction band offset of each height, in meV
+    ediff: np.ndarray               # J
+    dipoles: np.ndarray             # Å
+    osc_strength: np.ndarray
+    solve_times: np.ndarray = None  # s per point, NaN unless stats are recorded
+    stats: SolverStats.SolverStats = field(default_factory=lambda: SolverStats.NULL_STATS)    # summed over the points
+
+
+@dataclass
+class SweepPoint:
+    """Result at one sweep point, as yielded by TransitionSweep.iter_results."""
+    index: tuple                    # (K, height, width) indices into the sweep ranges
+    K: float
+    height: float
+    width: float
+    ediff: float
+    dipole: float
+    osc_strength: float
+    stats: dict = None              # SolverStats.as_dict of the point, when recorded
+
+
+class TransitionSweep:
+    def __init__(self, composition: Composition, material, dz, solver, nonparabolicity, nstmax, i, j) -> None:
+        """Sweep of the transition between levels i and j of a structure.
+
+        At each point the width of layer 1 (the well) is set to the swept
+        width and the molar content of the first and last layers (the
+        barriers) to the swept height.
+
+        Args:
+            composition (Composition): Base structure
+            material (str): Heterostructure material, as for Grid
+            dz (float): Grid step in Å
+            solver (str): "FDM" or "TMM"
+            nonparabolicity (str): Nonparabolicity model, as for SolverFactory
+            nstmax (int): Max number of energy levels
+            i (int): Upper level, counted from 1
+            j (int): Lower level, counted from 1
+        """
+        self.layers = composition.as_array()
+        self.material = material
+        self.dz = dz
+        self.solver = solver
+        self.nonparabolicity = nonparabolicity
+        self.nstmax = nstmax
+        self.i = i
+        self.j = j
+        self.parallel = True
+        self.chunksize = None
+        self.collect_stats = SolverStats.is_enabled()
+
+    # Set methods
+    def set_parallel(self, val):
+        """Run the points in the shared worker pool (True) or in this process."""
+        self.parallel = bool(val)
+
+    def set_chunksize(self, val):
+        """Points per pool task. Points in a task run in order and warm-start
+        from each other. None picks about four tasks per worker."""
+        self.chunksize = None if val is None else max(1, int(val))
+
+    def set_stats(self, val):
+        """Record SolverStats for every point, including the Grid and solver
+        setup ("setup") and the whole point ("point")."""
+        self.collect_stats = bool(val)
+
+    def get_composition(self, h, w):
+        arr = self.layers.copy()
+        arr[1][0] = w
+        arr[0][1] = h
+        arr[-1][1] = h
+        return Composition.from_array(arr)
+
+    def solve_point(self, K, h, w, warm_start=None, in_worker=False):
+        """Transition at one sweep point. Inside a pool worker the solver
+        runs serially, as pools do not nest.
+
+        Returns:
+            tuple: (ediff, dipole, oscillator strength), NaN when missing,
+                the solver's warm start for the next point and its stats as a
+                dict, or None when they are not recorded
+        """
+        stats = SolverStats.SolverStats() if self.collect_stats else SolverStats.NULL_STATS
+        with stats.phase("point"):
+            with stats.phase("setup"), SolverStats.recording(stats):
+                G = Grid(self.get_composition(h, w), self.dz, self.material)
+                G.set_K(K)
+                solver = SolverFactory.create(G, self.solver, self.nonparabolicity, self.nstmax)
+
+            if in_worker:
+                solver.set_parallel(False)
+            solver.set_warm_start(warm_start)
+            energies, wavefunctions = solver.get_wavefunctions()
+
+            T = TransitionCalculator()
+            values = T.calculate(G.z, energies, wavefunctions, self.i, self.j)
+
+        values = tuple(np.nan if v is None else v for v in values)
+        return values, solver.get_warm_start(), stats.as_dict() if stats.enabled else None
+
+    def run_points(self, points, in_worker=False):
+        """Solve (K, h, w) points in order, each warm-started from the last.
+
+        Returns:
+            tuple: np.ndarray of shape (len(points), 3) of ediff, dipole and
+                oscillator strength, and the list of stats of the points
+        """
+        out = np.empty((len(points), 3))
+        stats = []
+        warm_start = None
+        for n, (K, h, w) in enumerate(points):
+            out[n], warm_start, point_stats = self.solve_point(K, h, w, warm_start, in_worker)
+            stats.append(point_stats)
+        return out, stats
+
+    def get_chunks(self, K_values, heights, widths):
+        """Sweep points as ((iK, ih, iw), (K, h, w)) pairs, split into chunks
+        of chunksize consecutive points along the width axis."""
+        points = [((a, b, c), (K, h, w))
+                  for a, K in enumerate(K_values)
+                  for b, h in enumerate(heights)
+                  for c, w in enumerate(widths)]
+        chunksize = self.chunksize
+        if chunksize is None:
+            chunksize = max(1, math.ceil(len(points) / (4*(os.cpu_count() or 1))))
+        return [points[n:n+chunksize] for n in range(0, len(points), chunksize)]
+
+    def iter_results(self, K_values, heights, widths):
+        """Yield a SweepPoint for every combination of K, height and width as
+        soon as it is solved.
+
+        In the worker pool, points arrive a chunk at a time and chunks in
+        order of completion, so points can arrive out of order. Closing the
+        generator cancels the chunks that have not started.
+        """
+        chunks = self.get_chunks(K_values, heights, widths)
+
+        if self.parallel and len(chunks) > 1:
+            pool = get_pool()
+            futures = {pool.submit(_run_points, self, [p for _, p in chunk]): chunk for chunk in chunks}
+            try:
+                for f in as_completed(futures):
+                    out, stats = f.result()
+                    for (index, point), values, point_stats in zip(futures[f], out, stats):
+                        yield SweepPoint(index, *point, *values, point_stats)
+            finally:
+                for f in futures:
+                    f.cancel()
+        else:
+            for chunk in chunks:
+                warm_start = None
+                for index, point in chunk:
+                    values, warm_start, point_stats = self.solve_point(*point, warm_start)
+                    yield SweepPoint(index, *point, *values, point_stats)
+
+    def run(self, K_values, heights, widths, progress=None):
+        """Solve every combination of K, height and width.
+
+        Args:
+            K_values (list): Biases in kV/cm
+            heights (list): Barrier molar contents
+            widths (list): Well widths in Å
+            progress (callable): Called as progress(done, total) after each
+                finished point
+
+        Returns:
+            SweepResult
+        """
+        K_values, heights, widths = (np.asarray(v, dtype=float) for v in (K_values, heights, widths))
+        shape = (len(K_values), len(heights), len(widths))
+        values = np.full((3,) + shape, np.nan)
+        solve_times = np.full(shape, np.nan)
+        stats = SolverStats.SolverStats() if self.collect_stats else SolverStats.NULL_STATS
+
+        total = np.prod(shape)
+        for done, point in enumerate(self.iter_results(K_values, heights, widths), start=1):
+            values[(slice(None),) + point.index] = point.ediff, point.dipole, point.osc_strength
+            if point.stats is not None:
+                stats.merge(point.stats)
+                solve_times[point.index] = point.stats["timings"]["point"]
+            if progress is not None:
+                progress(done, total)
+
+        return SweepResult(K_values, heights, widths, self.get_barrier_heights(heights), *values,
+                           solve_times, stats)
+
+    def get_barrier_heights(self, heights):
+        """Conduction band offset of each barrier molar content, in meV."""
+        M = Material(self.material)
+        return ConstAndScales.E * M.interpolate_parameter(np.asarray(heights, dtype=float), M.V) / ConstAndScales.meV
+
+
+def _run_points(sweep, points):
+    return sweep.run_points(points, in_worker=True)
@@ -0,0 +1,129 @@
+#
+#   Long-lived process pool shared by the solvers, and shared-memory blocks
+#   used to hand arrays to its workers without pickling them.
+#
+
+import atexit
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import resource_tracker, shared_memory
+import threading
+
+import numpy as np
+
+_pool = None
+_pool_lock = threading.Lock()     # the app submits from several threads
+
+
+def get_pool():
+    """Return the module-level ProcessPoolExecutor, starting it on first use
+    or again if a worker died and left it broken."""
+    global _pool
+    with _pool_lock:
+        if _pool is None or getattr(_pool, "_broken", False):
+            if _pool is None:
+                atexit.register(shutdown_pool)
+            # Workers must share this process's resource tracker. One started
+            # inside a worker would flag every block it attached to as leaked.
+            resource_tracker.ensure_running()
+            _pool = ProcessPoolExecutor()
+        return _pool
+
+
+def shutdown_pool():
+    """Stop the worker processes. The next get_pool call starts new ones."""
+    global _pool
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+
+
+class SharedArrays:
+    """Named arrays packed into one shared memory block.
+
+    The creating process owns the block and must call release() (or use the
+    object as a context manager). Pickling only sends the block name and the
+    layout, so handing the object to a worker is cheap; the worker calls
+    attach() to get array views onto the same memory.
+    """
+    _ALIGN = 64
+
+    def __init__(self, arrays):
+        """
+        Args:
+            arrays (dict): Mapping of name to np.ndarray, copied into the block
+        """
+        self.layout = {}
+        offset = 0
+        for key, arr in arrays.items():
+            arr = np.asarray(arr)
+            self.layout[key] = (offset, arr.shape, arr.dtype.str)
+            offset += -(-arr.nbytes // self._ALIGN) * self._ALIGN
+
+        self._shm = shared_memory.SharedMemory(create=True, size=max(offset, 1))
+        self.name = self._shm.name
+        self._arrays = self._map(self._shm.buf)
+        for key, arr in arrays.items():
+            self._arrays[key][...] = arr
+
+    def _map(self, buf):
+        return {key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=buf, offset=offset)
+                for key, (offset, shape, dtype) in self.layout.items()}
+
+    def __getstate__(self):
+        return {"name": self.name, "layout": self.layout}
+
+    def __setstate__(self, state):
+        self.name = state["name"]
+        self.layout = state["layout"]
+        self._shm = None
+        self._arrays = None
+
+    def __getitem__(self, key):
+        return self.attach()[key]
+
+    def attach(self):
+        """Array views onto the block, attaching to it on first use in this
+        process."""
+        if self._arrays is None:
+            self._shm = _attach(self.name)
+            self._arrays = self._map(self._shm.buf)
+        return self._arrays
+
+    def release(self):
+        """Free the block. Only the creating process should call this, after
+        copying out anything it still needs."""
+        self._arrays = None
+        if self._shm is not None:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+
+# Blocks a worker is attached to, most recent last. Older ones are dropped
+# once their owner has moved on to new blocks.
+_attached = {}
+_MAX_ATTACHED = 4
+
+
+def _attach(name):
+    if name in _attached:
+        return _attached[name]
+    while len(_attached) >= _MAX_ATTACHED:
+        old = _attached.pop(next(iter(_attached)))
+        try:
+            old.close()
+        except BufferError:
+            pass
+    # track=False: the owner unlinks the block, not the worker
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+    _attached[name] = shm
+    return shm
@@ -0,0 +1,170 @@
+import argparse
+import csv
+import json
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src import ConstAndScales
+from src.Composition import Composition
+from src.Grid import Grid
+from src.Solvers_FDM import SolverFactory
+
+# Accuracy against cost: solve the test structures with every solver and
+# nonparabolicity model at several grid steps and scan settings, compare the
+# levels with the published tables St*_Paper.csv and print the mean absolute
+# error against the runtime. Each published level is matched to the nearest
+# computed level within --tolerance; published levels left without a match are
+# counted as missed and computed levels left over as spurious. Cases on the Pareto front of their model (no
+# other case is both faster and more accurate) are marked with *. Run from
+# python_implementation/, e.g.
+#   python test/accuracy_report.py --budget 0.05
+# Ekenberg has no published column and is left out.
+
+structures = {
+    1: ("test/Structure1_BTC_GaAs_AlGaAs.txt", "test/St1_Paper.csv", "AlGaAs", 1.9),
+    2: ("test/Structure2_LO_InGaAs_InAlAs.txt", "test/St2_Paper.csv", "InGaAs_InAlAs", 10.0),
+    3: ("test/Structure3_LO_InGaAs_GaAsSb.txt", "test/St3_Paper.csv", "InGaAs_GaAsSb", 8.0),
+}
+
+# Settings tried for each solver, as setter name -> value
+scan_settings = {
+    "FDM": {
+        "default": {},
+        "nonlinear": {"engine": "nonlinear"},       # Kane only
+    },
+    "TMM": {
+        "batched": {"scan_mode": "batched"},
+        "adaptive": {"scan_mode": "adaptive"},
+        "nodes": {"scan_mode": "nodes"},
+    },
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--structures", type=int, nargs="+", default=list(structures), choices=structures)
+parser.add_argument("--models", nargs="+", default=["Parabolic", "Taylor", "Kane"])
+parser.add_argument("--dz", type=float, nargs="+", default=[1.0, 0.8, 0.6, 0.4], help="grid steps in Å")
+parser.add_argument("--repeat", type=int, default=1)
+parser.add_argument("--tolerance", type=float, default=1.0,
+                    help="largest distance in meV at which a computed level matches a published one")
+parser.add_argument("--budget", type=float, help="print the cheapest case of each model within this MAE, in meV")
+parser.add_argument("--output", help="write every case to this JSON file")
+args = parser.parse_args()
+
+
+def read_reference(path):
+    """Published levels by model, in meV."""
+    with open(path, newline="") as f:
+        rows = [row for row in csv.reader(f) if row]
+    models = rows[0][1:]
+    return {m: np.array([float(row[n+1]) for row in rows[1:]]) for n, m in enumerate(models)}
+
+
+def match_levels(energies, reference, tolerance):
+    """Pair computed and published levels one to one, closest pairs first,
+    leaving out pairs further apart than tolerance.
+
+    Returns:
+        tuple: Errors of the matched pairs in meV, and the numbers of missed
+            published and spurious computed levels
+    """
+    distance = abs(energies[:, None] - reference[None, :])
+    used_energies, used_reference, errors = set(), set(), []
+    for i, j in zip(*np.unravel_index(np.argsort(distance, axis=None), distance.shape)):
+        if distance[i, j] > tolerance:
+            break
+        if i in used_energies or j in used_reference:
+            continue
+        used_energies.add(i)
+        used_reference.add(j)
+        errors.append(distance[i, j])
+    return errors, len(reference) - len(errors), len(energies) - len(errors)
+
+
+def make_solver(G, solver, model, nst, settings):
+    S = SolverFactory.create(G, solver, model, nst)
+    S.set_cache(None)
+    for name, val in settings.items():
+        getattr(S, "set_" + name)(val)
+    return S
+
+
+def run_case(solver, model, dz, settings):
+    """Solve every structure and return the error of each against the paper."""
+    errors, missed, spurious, elapsed = [], 0, 0, 0.0
+    for structure in args.structures:
+        layer_file, table, material, K = structures[structure]
+        reference = read_reference(table)[model]
+
+        G = Grid(Composition.from_file(layer_file), dz, material)
+        G.set_K(K)
+        solve = lambda: make_solver(G, solver, model, len(reference), settings).get_wavefunctions()
+
+        energies, _ = solve()
+        elapsed += min(timeit.repeat(solve, repeat=args.repeat, number=1))
+
+        matched, n_missed, n_spurious = match_levels(energies / ConstAndScales.meV, reference, args.tolerance)
+        errors.extend(matched)
+        missed += n_missed
+        spurious += n_spurious
+
+    return {
+        "solver": solver, "model": model, "dz": dz, "settings": settings,
+        "mae": float(np.mean(errors)) if errors else float("nan"),
+        "max_error": float(np.max(errors, initial=0)),
+        "missed": missed, "spurious": spurious, "time": elapsed,
+    }
+
+
+def mark_pareto(cases):
+    # Within each model, a case is on the front when no other case is at
+    # least as fast and as accurate and better in one of the two. Errors are
+    # compared at the printed precision, so rounding noise does not count.
+    mae = lambda c: round(c["mae"], 4)
+    for case in cases:
+        case["pareto"] = not any(
+            other["model"] == case["model"] and other["missed"] <= case["missed"]
+            and other["spurious"] <= case["spurious"]
+            and other["time"] <= case["time"] and mae(other) <= mae(case)
+            and (other["time"] < case["time"] or mae(other) < mae(case))
+            for other in cases)
+
+
+cases = []
+for model in args.models:
+    for solver in ["FDM", "TMM"]:
+        for name, settings in scan_settings[solver].items():
+            if settings.get("engine") == "nonlinear" and model != "Kane":
+                continue
+            for dz in args.dz:
+                case = run_case(solver, model, dz, settings)
+                case["scan"] = name
+                cases.append(case)
+
+mark_pareto(cases)
+
+print(f"Structures {', '.join(map(str, args.structures))}; time is the total over them\n")
+print(f"{'model':<11}{'solver':<8}{'scan':<11}{'dz':>6}{'time (s)':>10}{'MAE (meV)':>11}{'max (meV)':>11}{'missed':>8}{'spurious':>10}")
+for case in sorted(cases, key=lambda c: (c["model"], c["time"])):
+    mark = " *" if case["pareto"] else ""
+    print(f"{case['model']:<11}{case['solver']:<8}{case['scan']:<11}{case['dz']:>6g}{case['time']:>10.4f}"
+          f"{case['mae']:>11.4f}{case['max_error']:>11.4f}{case['missed']:>8}{case['spurious']:>10}{mark}")
+
+if args.budget is not None:
+    print(f"\nCheapest case within {args.budget:g} meV MAE:")
+    for model in args.models:
+        within = [c for c in cases if c["model"] == model and c["missed"] == 0 and c["spurious"] == 0 and c["mae"] <= args.budget]
+        if within:
+            best = min(within, key=lambda c: c["time"])
+            print(f"  {model:<11}{best['solver']} {best['scan']}, dz = {best['dz']:g} Å: "
+                  f"{best['mae']:.4f} meV in {best['time']:.4f} s")
+        else:
+            print(f"  {model:<11}none")
+
+if args.output:
+    with open(args.output, "w") as f:
+        json.dump(cases, f, indent=2)
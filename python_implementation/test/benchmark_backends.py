@@ -0,0 +1,76 @@
+import argparse
+import os
+import sys
+import timeit
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src import ConstAndScales
+from src.Composition import Composition
+from src.Grid import Grid
+from src.Solvers_FDM import SolverFactory
+
+# Compare the numpy and numba backends of the TMM solvers on one of the test
+# structures: agreement of M11, dM11/dE and the refined energies, and the
+# time spent in each kernel. Run from python_implementation/, e.g.
+#   python test/benchmark_backends.py --structure 1
+
+structures = {
+    1: ("test/Structure1_BTC_GaAs_AlGaAs.txt", "AlGaAs", 0.8, 1.9),
+    2: ("test/Structure2_LO_InGaAs_InAlAs.txt", "InGaAs_InAlAs", 0.6, 10.0),
+    3: ("test/Structure3_LO_InGaAs_GaAsSb.txt", "InGaAs_GaAsSb", 0.6, 8.0),
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--structure", type=int, default=1, choices=structures)
+parser.add_argument("--nst", type=int, default=10)
+parser.add_argument("--energies", type=int, default=256, help="energies per kernel call")
+parser.add_argument("--repeat", type=int, default=3)
+args = parser.parse_args()
+
+layer_file, material, dz, K = structures[args.structure]
+G = Grid(Composition.from_file(layer_file), dz, material)
+G.set_K(K)
+
+
+def best(func):
+    return min(timeit.repeat(func, repeat=args.repeat, number=1))
+
+
+print(f"Structure {args.structure}: nz = {G.get_nz()}, {args.energies} energies per call\n")
+print(f"{'model':<10}{'kernel':<14}{'numpy (s)':>11}{'numba (s)':>11}{'speedup':>9}{'max rel diff':>14}")
+
+for model in ["Parabolic", "Taylor", "Kane", "Ekenberg"]:
+    solvers = {}
+    for backend in ["numpy", "numba"]:
+        solvers[backend] = SolverFactory.create(G, "TMM", model, args.nst)
+        solvers[backend].set_backend(backend)
+        solvers[backend].set_cache(None)     # time the solves, not the cache
+    ref, fast = solvers["numpy"], solvers["numba"]
+    energies = ref.get_scan_energies()
+    # Keep clear of the values of V, where dk/dE is singular
+    energies = ref._avoid_profile_values(np.linspace(energies[0], energies[-1], args.energies))
+    fast.get_m11_with_derivative(energies[:2])  # compile, or load from cache
+    fast.get_wavefunction(energies[0])
+
+    kernels = {
+        "m11": lambda S: S.get_m11(energies),
+        "m11+deriv": lambda S: S.get_m11_with_derivative(energies)[1],
+        "wavefunction": lambda S: S.get_wavefunction(energies[len(energies)//2]),
+    }
+    for name, kernel in kernels.items():
+        a, b = kernel(ref), kernel(fast)
+        diff = np.max(abs(a - b) / np.maximum(abs(a), np.max(abs(a))*1e-12))
+        t_ref, t_fast = best(lambda: kernel(ref)), best(lambda: kernel(fast))
+        print(f"{model:<10}{name:<14}{t_ref:>11.4f}{t_fast:>11.4f}{t_ref/t_fast:>8.1f}x{diff:>14.2e}")
+
+    t_ref = best(lambda: ref.get_wavefunctions())
+    t_fast = best(lambda: fast.get_wavefunctions())
+    E_ref, E_fast = ref.get_wavefunctions()[0], fast.get_wavefunctions()[0]
+    if len(E_ref) == len(E_fast):
+        diff = f"{np.max(abs(E_ref - E_fast), initial=0)/ConstAndScales.meV:.2e} meV"
+    else:
+        diff = f"{len(E_ref)} vs {len(E_fast)} states"
+    print(f"{model:<10}{'solve':<14}{t_ref:>11.4f}{t_fast:>11.4f}{t_ref/t_fast:>8.1f}x{diff:>14}")
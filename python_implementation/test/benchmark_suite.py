@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import timeit
+import tracemalloc
+
+import numpy as np
+import scipy
+
+try:
+    import numba
+    numba_version = numba.__version__
+except ImportError:
+    numba_version = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from src.Composition import Composition
+from src.Grid import Grid
+from src.Solvers_FDM import SolverFactory
+
+# Time every SolverFactory solver on the test structures over a ladder of grid
+# steps and biases, write the results as JSON and compare them with an earlier
+# run, by default the reference run committed as test/benchmark_baseline.json.
+# Run from python_implementation/, e.g.
+#   python test/benchmark_suite.py
+#   python test/benchmark_suite.py --output bench.json --baseline other.json
+#   python test/benchmark_suite.py --update-baseline
+# The exit status is 1 when a case got slower or used more memory than the
+# thresholds allow, or found a different number of states. Times are only
+# comparable on the machine the baseline was recorded on, whose details are
+# in its metadata; the comparison notes when they differ.
+#
+# Wall time is the best of --repeat solves after one warm-up solve, which
+# starts the worker pool and compiles or loads any numba kernels. Peak memory
+# is measured by tracemalloc in a separate solve, and only covers this
+# process, not the pool workers. The result cache is bypassed throughout.
+
+default_baseline = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+structures = {
+    1: ("test/Structure1_BTC_GaAs_AlGaAs.txt", "AlGaAs", 1.9),
+    2: ("test/Structure2_LO_InGaAs_InAlAs.txt", "InGaAs_InAlAs", 10.0),
+    3: ("test/Structure3_LO_InGaAs_GaAsSb.txt", "InGaAs_GaAsSb", 8.0),
+}
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--structures", type=int, nargs="+", default=list(structures), choices=structures)
+parser.add_argument("--solvers", nargs="+", default=[f"{s}:{m}" for s, m in SolverFactory.solver_map],
+                    help="solver:nonparabolicity pairs, e.g. TMM:Kane")
+parser.add_argument("--dz", type=float, nargs="+", default=[1.0, 0.6, 0.4], help="grid steps in Å")
+parser.add_argument("--bias-factors", type=float, nargs="+", default=[0.5, 1.0],
+                    help="biases as multiples of each structure's design bias")
+parser.add_argument("--nst", type=int, default=10)
+parser.add_argument("--repeat", type=int, default=3)
+parser.add_argument("--serial", action="store_true", help="keep each solve in this process")
+parser.add_argument("--output", help="write the results to this JSON file")
+parser.add_argument("--baseline", default=default_baseline,
+                    help="JSON file of an earlier run to compare with, test/benchmark_baseline.json "
+                         "by default; pass an empty string to skip the comparison")
+parser.add_argument("--update-baseline", action="store_true",
+                    help="write the results to test/benchmark_baseline.json instead of comparing")
+parser.add_argument("--time-threshold", type=float, default=0.25,
+                    help="allowed relative increase in wall time")
+parser.add_argument("--memory-threshold", type=float, default=0.25,
+                    help="allowed relative increase in peak memory")
+parser.add_argument("--min-time", type=float, default=0.05,
+                    help="ignore time increases smaller than this, in s")
+args = parser.parse_args()
+
+
+def make_solver(G, solver, model):
+    S = SolverFactory.create(G, solver, model, args.nst)
+    S.set_cache(None)
+    S.set_parallel(not args.serial)
+    return S
+
+
+def run_case(structure, solver, model, dz, K):
+    layer_file, material, _ = structures[structure]
+    G = Grid(Composition.from_file(layer_file), dz, material)
+    G.set_K(K)
+
+    energies, _ = make_solver(G, solver, model).get_wavefunctions()
+    times = timeit.repeat(lambda: make_solver(G, solver, model).get_wavefunctions(), repeat=args.repeat, number=1)
+
+    tracemalloc.start()
+    make_solver(G, solver, model).get_wavefunctions()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        "structure": structure, "solver": solver, "model": model, "dz": dz, "K": K,
+        "nz": int(G.get_nz()), "states": len(energies),
+        "time": min(times), "times": times, "peak_memory": peak,
+    }
+
+
+def case_key(result):
+    return (result["structure"], result["solver"], result["model"], result["dz"], result["K"])
+
+
+def get_machine():
+    processor = platform.processor()
+    if os.path.exists("/proc/cpuinfo"):
+        # platform.processor() is often empty on Linux
+        with open("/proc/cpuinfo") as f:
+            names = [line.split(":", 1)[1].strip() for line in f if line.startswith("model name")]
+        processor = names[0] if names else processor
+    return {
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "processor": processor,
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(results, baseline):
+    """Print each case against the baseline and return the regressions."""
+    base = {case_key(r): r for r in baseline["results"]}
+    regressions = []
+
+    machine = baseline["metadata"].get("machine")
+    if machine != get_machine():
+        print(f"\nNote: the baseline was recorded on another machine, {machine}; times may not be comparable.")
+
+    print(f"\n{'case':<36}{'time (s)':>10}{'base (s)':>10}{'ratio':>8}{'memory':>9}{'states':>9}")
+    for r in results:
+        b = base.get(case_key(r))
+        name = "St{} {}:{} dz={:g} K={:g}".format(*case_key(r))
+        if b is None:
+            print(f"{name:<36}{r['time']:>10.4f}{'-':>10}")
+            continue
+
+        ratio = r["time"] / b["time"]
+        mem_ratio = r["peak_memory"] / max(b["peak_memory"], 1)
+        problems = []
+        if r["time"] > b["time"]*(1 + args.time_threshold) and r["time"] - b["time"] > args.min_time:
+            problems.append("time")
+        if mem_ratio > 1 + args.memory_threshold:
+            problems.append("memory")
+        if r["states"] != b["states"]:
+            problems.append("states")
+        if problems:
+            regressions.append((name, problems))
+
+        states = f"{b['states']}->{r['states']}" if r["states"] != b["states"] else str(r["states"])
+        flag = "  <- " + ", ".join(problems) if problems else ""
+        print(f"{name:<36}{r['time']:>10.4f}{b['time']:>10.4f}{ratio:>7.2f}x{mem_ratio:>8.2f}x{states:>9}{flag}")
+    return regressions
+
+
+results = []
+print(f"{'case':<36}{'nz':>7}{'states':>8}{'time (s)':>10}{'peak (MB)':>11}")
+for structure in args.structures:
+    for pair in args.solvers:
+        solver, model = pair.split(":")
+        for dz in args.dz:
+            for factor in args.bias_factors:
+                r = run_case(structure, solver, model, dz, factor*structures[structure][2])
+                results.append(r)
+                name = "St{} {}:{} dz={:g} K={:g}".format(*case_key(r))
+                print(f"{name:<36}{r['nz']:>7}{r['states']:>8}{r['time']:>10.4f}{r['peak_memory']/2**20:>11.2f}")
+
+report = {
+    "metadata": {
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "numba": numba_version,
+        "machine": get_machine(),
+        "settings": {"nst": args.nst, "repeat": args.repeat, "serial": args.serial},
+    },
+    "results": results,
+}
+
+for path in (args.output, default_baseline if args.update_baseline else None):
+    if path:
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+
+if args.baseline == default_baseline and not os.path.exists(default_baseline):
+    print("\nNo baseline to compare with; record one with --update-baseline.")
+elif args.baseline and not args.update_baseline:
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f))
+    if regressions:
+        print(f"\n{len(regressions)} regression(s):")
+        for name, problems in regressions:
+            print(f"  {name}: {', '.join(problems)}")
+        sys.exit(1)
+    print("\nNo regressions.")
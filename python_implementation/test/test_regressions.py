@@ -0,0 +1,556 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+import scipy.sparse as sp
+
+test_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(test_dir, ".."))
+
+from src import ConstAndScales
+from src import FDMKernels
+from src import TMMKernels
+from src.Composition import Composition
+from src.Grid import Grid
+from src.Solvers_FDM import SolverFactory
+
+# Regression tests for solver bugs found in review. Run from
+# python_implementation/ with
+#   python -m pytest -q test/test_regressions.py
+
+
+def make_solver(layers, K, solver, model, nst, material="AlGaAs", dz=1.0, **settings):
+    G = Grid(Composition.from_array(layers), dz, material)
+    G.set_K(K)
+    S = SolverFactory.create(G, solver, model, nst)
+    S.set_cache(None)
+    for name, val in settings.items():
+        getattr(S, "set_" + name)(val)
+    return S
+
+
+@pytest.mark.parametrize("model", ["Taylor", "Kane"])
+@pytest.mark.parametrize("nst", [3, 8])
+def test_warm_start_keeps_lowest_states_as_well_widens(model, nst):
+    # A wider well adds states below the previous ground state, which a warm
+    # start must not lose
+    warm_start = None
+    for width in np.linspace(40, 600, 8):
+        layers = [[200, 0.45], [width, 0], [200, 0.45]]
+        S = make_solver(layers, 5, "FDM", model, nst, warm_start=warm_start)
+        energies, _ = S.get_wavefunctions()
+        warm_start = S.get_warm_start()
+
+        cold, _ = make_solver(layers, 5, "FDM", model, nst).get_wavefunctions()
+        assert len(energies) == len(cold), width
+        np.testing.assert_allclose(energies / ConstAndScales.meV, cold / ConstAndScales.meV, atol=1e-3)
+
+
+@pytest.mark.parametrize("nst", [0, 4])
+def test_spectrum_slicing_matches_single_shift(monkeypatch, nst):
+    layers = [[200, 0.3], [120, 0], [30, 0.3], [80, 0], [200, 0.3]]
+    S = make_solver(layers, 2, "FDM", "Taylor", nst)
+    single, _ = S.get_wavefunctions()
+    S.set_spectrum_slices(5)
+    sliced, _ = S.get_wavefunctions()
+    np.testing.assert_allclose(sliced / ConstAndScales.meV, single / ConstAndScales.meV, atol=1e-6)
+
+    shifts = np.append(S.get_energy_window(), single + 1e-6*ConstAndScales.meV)
+    counts = S.count_eigenvalues_below(shifts)
+    monkeypatch.setattr(FDMKernels, "HAVE_NUMBA", False)
+    np.testing.assert_array_equal(S.count_eigenvalues_below(shifts), counts)
+    if nst == 0:
+        assert counts[1] - counts[0] == len(single)
+    np.testing.assert_array_equal(counts[2:] - counts[0], np.arange(1, len(single)+1))
+
+
+def test_spectrum_slices_warns_without_pencil():
+    S = make_solver([[200, 0.3], [100, 0], [200, 0.3]], 0, "FDM", "Kane", 3)
+    with pytest.warns(UserWarning, match="no pencil"):
+        S.set_spectrum_slices(4)
+
+
+@pytest.mark.parametrize("model", ["Parabolic", "Taylor", "Kane", "Ekenberg"])
+def test_kernel_matches_scalar_methods(model):
+    S = make_solver([[100, 0.3], [60, 0], [20, 0.15], [100, 0.3]], 5, "TMM", model, 3)
+    E = S._avoid_profile_values(np.array([0.2, 0.7, 1.1]) * max(S.V))
+    k, dk, qpq, dqpq = S.get_kernel(E)
+    M, dM = S.get_transfer_matrices_with_derivative(E)
+    for i, Ei in enumerate(E):
+        for j in range(0, S.nz, 17):
+            np.testing.assert_allclose(k[i, j], S.get_wavevector(j, Ei), rtol=1e-12)
+            np.testing.assert_allclose(dk[i, j], S.get_wavevector_derivative(j, Ei), rtol=1e-10)
+            if j > 0:
+                np.testing.assert_allclose(qpq[i, j], S.get_coefficient(j, Ei), rtol=1e-12)
+                np.testing.assert_allclose(dqpq[i, j], S.get_coefficient_derivative(j, Ei), rtol=1e-9, atol=1e-12*abs(dqpq[i]).max())
+                np.testing.assert_allclose(M[i, j], S.get_matrix_j(j, Ei), rtol=1e-10)
+                np.testing.assert_allclose(dM[i, j], S.get_matrix_derivative_j(j, Ei), rtol=1e-8, atol=1e-12*abs(dM[i, j]).max())
+
+
+@pytest.mark.parametrize("model", ["Parabolic", "Kane", "Ekenberg"])
+def test_refine_root_matches_bisection(model):
+    # 60 bisection steps on the sign of d|M11|/dE, as the scan brackets were
+    # refined before
+    S = make_solver([[200, 0.3], [80, 0], [30, 0.3], [60, 0], [200, 0.3]], 5, "TMM", model, 4)
+    tol = S.energy_tolerance * ConstAndScales.meV
+    for Elo, Ehi in S.scan_batched():
+        Ex, iterations = S.refine_root(Elo, Ehi)
+        a, b = Elo, Ehi
+        for _ in range(60):
+            m11, dm11 = S.get_m11_with_derivative(0.5*(a+b))
+            if (m11.conjugate()*dm11).real < 0:
+                a = 0.5*(a+b)
+            else:
+                b = 0.5*(a+b)
+        assert abs(Ex - 0.5*(a+b)) < tol
+        assert iterations <= 8
+
+
+@pytest.mark.skipif(not TMMKernels.HAVE_NUMBA, reason="numba is not installed")
+@pytest.mark.parametrize("model", ["Parabolic", "Taylor", "Kane", "Ekenberg"])
+def test_numba_backend_matches_numpy(model):
+    layers = [[200, 0.3], [80, 0], [30, 0.3], [60, 0], [200, 0.3]]
+    S = make_solver(layers, 5, "TMM", model, 4)
+    E = S._avoid_profile_values(np.linspace(0.05, 0.95, 7) * max(S.V))
+    m11, dm11 = S.get_m11_with_derivative(E)
+    energies, psis = S.get_wavefunctions()
+
+    N = make_solver(layers, 5, "TMM", model, 4, backend="numba")
+    np.testing.assert_allclose(N.get_m11(E), abs(m11), rtol=1e-8)
+    m11_numba, dm11_numba = N.get_m11_with_derivative(E)
+    np.testing.assert_allclose(m11_numba, m11, rtol=1e-8)
+    np.testing.assert_allclose(dm11_numba, dm11, rtol=1e-8)
+    energies_numba, psis_numba = N.get_wavefunctions()
+    np.testing.assert_allclose(energies_numba / ConstAndScales.meV, energies / ConstAndScales.meV, atol=1e-6)
+    np.testing.assert_allclose(np.array(psis_numba), np.array(psis), atol=1e-6*np.max(np.abs(psis)))
+
+
+@pytest.mark.parametrize("model", ["Parabolic", "Kane"])
+def test_wavefunction_matches_scalar_loop(model):
+    S = make_solver([[200, 0.3], [80, 0], [30, 0.3], [60, 0], [200, 0.3]], 5, "TMM", model, 2)
+    energies, psis = S.get_wavefunctions()
+    for E, psi in zip(energies, psis):
+        expected = np.zeros(S.nz, dtype=complex)
+        expected[0] = 1.0
+        AB = np.array([1.0, 0.0], dtype=complex)
+        for j in range(1, S.nz):
+            qjzj = S.get_wavevector(j, E) * S.z[j]
+            AB = S.get_matrix_j(j, E) @ AB
+            expected[j] = np.real(AB[0]*np.exp(qjzj) + AB[1]*np.exp(-qjzj))
+        expected /= np.sqrt(np.trapezoid(abs(expected)**2) * S.dz / ConstAndScales.ANGSTROM)
+        np.testing.assert_allclose(psi, expected, rtol=0, atol=1e-6*np.max(abs(expected)))
+
+
+@pytest.mark.parametrize("layer_file, material", [
+    ("Structure1_BTC_GaAs_AlGaAs.txt", "AlGaAs"),
+    ("Structure2_LO_InGaAs_InAlAs.txt", "InGaAs_InAlAs"),
+    ("Structure3_LO_InGaAs_GaAsSb.txt", "InGaAs_GaAsSb"),
+])
+def test_grid_profiles_match_per_point_loop(layer_file, material):
+    composition = Composition.from_file(os.path.join(test_dir, layer_file))
+    G = Grid(composition, 0.7, material)
+    G.set_K(10)
+    thickness, alloy = composition.get_layer_thickness(), composition.get_alloy_profile()
+    z = G.get_z() / ConstAndScales.ANGSTROM
+    x = np.empty(G.get_nz())
+    layer, cum_sum = 0, thickness[0]
+    for i in range(G.get_nz()):
+        if z[i] >= cum_sum and layer < len(thickness)-1:
+            layer += 1
+            cum_sum += thickness[layer]
+        x[i] = alloy[layer]
+    np.testing.assert_array_equal(G.get_x(), x)
+
+    m = G.material
+    V0 = np.array([ConstAndScales.E * m.interpolate_parameter(xi, m.V) for xi in x])
+    V = V0 - ConstAndScales.E * G.K * ConstAndScales.kVcm * G.get_z()
+    np.testing.assert_array_equal(G.get_bandstructure_potential(), V - np.min(V))
+    np.testing.assert_array_equal(G.get_effective_mass(), [ConstAndScales.m0 * m.interpolate_parameter(xi, m.m) for xi in x])
+    np.testing.assert_array_equal(G.get_alpha_kane(), [m.get_alpha_kane(xi) / ConstAndScales.E for xi in x])
+    np.testing.assert_allclose(G.get_alphap_ekenberg(), [m.get_alpha0gp(xi)[0] / ConstAndScales.E for xi in x], rtol=1e-15)
+
+    # Cached and read-only; only V follows the bias
+    assert G.get_effective_mass() is G.get_effective_mass()
+    with pytest.raises(ValueError):
+        G.get_bandstructure_potential()[0] = 0.0
+    G.set_K(0)
+    np.testing.assert_array_equal(G.get_bandstructure_potential(), V0 - np.min(V0))
+
+
+def lil_parabolic(S, scale):
+    # Parabolic_FDM.construct_matrix as it was filled element by element
+    nz, meff, V = S.G.get_nz(), S.meff, S.V
+    A = sp.lil_matrix((nz, nz))
+    for i in range(nz-1):
+        if i != 0:
+            A[i, i-1] = -scale * (1.0/meff[i-1] + 1.0/meff[i])
+        A[i, i+1] = -scale * (1.0/meff[i+1] + 1.0/meff[i])
+        if i != 0:
+            A[i, i] = V[i] + scale * (1.0/meff[i+1] + 2.0/meff[i] + 1.0/meff[i-1])
+    A[0, 0] = A[1, 1]
+    A[nz-1, nz-1] = A[nz-2, nz-2]
+    return A
+
+
+def lil_taylor(S, scale):
+    # Taylor_FDM A and B as they were filled element by element, before the
+    # end points of both copied their neighbour
+    nz, meff, V, alpha = S.G.get_nz(), S.meff, S.V, S.alpha
+    A = sp.lil_matrix((nz, nz))
+    B = sp.lil_matrix((nz, nz))
+    for i in range(nz):
+        if i != 0:
+            B[i, i-1] = -scale * (alpha[i]/meff[i] + alpha[i-1]/meff[i-1])
+            A[i, i-1] = -scale * ((1.0+alpha[i-1]*V[i-1])/meff[i-1] + (1.0+alpha[i]*V[i])/meff[i])
+        if i != nz-1:
+            B[i, i+1] = -scale * (alpha[i]/meff[i] + alpha[i+1]/meff[i+1])
+            A[i, i+1] = -scale * ((1.0+alpha[i+1]*V[i+1])/meff[i+1] + (1.0+alpha[i]*V[i])/meff[i])
+        if i != 0 and i != nz-1:
+            B[i, i] = 1.0 + scale * (alpha[i+1]/meff[i+1] + 2.0*alpha[i]/meff[i] + alpha[i-1]/meff[i-1])
+            A[i, i] = V[i] + scale * ((1.0+alpha[i+1]*V[i+1])/meff[i+1] + 2.0*(1.0+alpha[i]*V[i])/meff[i] + (1.0+alpha[i-1]*V[i-1])/meff[i-1])
+    return A, B
+
+
+def lil_kane(S, scale):
+    # Kane_FDM companion matrix as it was filled element by element
+    nz, meff, V, alpha = S.G.get_nz(), S.meff, S.V, S.alpha
+    A = sp.lil_matrix((4*nz, 4*nz))
+    for i in range(nz):
+        A_i = 1.0 / alpha[i]
+        M_i = A_i / meff[i]
+        V_i = V[i]
+        if i == 0 or i == nz-1:
+            A_plus = A_minus = A_i
+            M_plus = M_minus = M_i
+            V_plus = V_minus = V_i
+        else:
+            A_plus, A_minus = 1.0/alpha[i+1], 1.0/alpha[i-1]
+            M_plus, M_minus = A_plus/meff[i+1], A_minus/meff[i-1]
+            V_plus, V_minus = V[i+1], V[i-1]
+        B_minus = A_minus*A_i
+        B_0 = A_minus*A_plus
+        B_plus = A_plus*A_i
+        if i != 0:
+            A[3*nz+i, i-1] = -scale * (1.0-V_plus/A_plus)*(M_minus*B_plus*(1.0 - V_i/A_i) + M_i*B_0*(1.0-V_minus/A_minus))
+            A[3*nz+i, nz+i-1] = -scale * (M_i*(A_minus+A_plus-V_minus-V_plus) + M_minus*(A_plus+A_i-V_i-V_plus))
+            A[3*nz+i, 2*nz+i-1] = -scale * (M_minus+M_i)
+        if i != nz-1:
+            A[3*nz+i, i+1] = -scale * (1.0-V_minus/A_minus)*(M_plus*B_minus*(1.0 - V_i/A_i) + M_i*B_0*(1.0-V_plus/A_plus))
+            A[3*nz+i, nz+i+1] = -scale * (M_i*(A_minus+A_plus-V_minus-V_plus)+M_plus*(A_minus+A_i-V_i-V_minus))
+            A[3*nz+i, 2*nz+i+1] = -scale * (M_plus+M_i)
+        A[3*nz+i, i] = -scale * (V_i * (M_plus*A_minus+M_minus*A_plus) + V_minus * (M_plus*A_i+2.0*M_i*A_plus) + V_plus * (M_minus*A_i+2.0*M_i*A_minus) - M_plus*V_i*V_minus - M_minus*V_i*V_plus - 2.0*M_i*V_plus*V_minus - M_plus*B_minus - 2.0*M_i*B_0 - M_minus*B_plus) + V_i * (1.0-V_i/A_i) * (A_i*B_0 - B_plus*V_minus - B_minus*V_plus + A_i*V_minus*V_plus)
+        A[3*nz+i, nz+i] = -scale * (M_plus*(V_i+V_minus-A_i-A_minus) + M_minus*(V_i+V_plus-A_i-A_plus) + 2.0*M_i*(V_minus+V_plus-A_minus-A_plus)) - V_i*V_i*(A_plus+A_minus) + V_i * (B_minus+2.0*B_0+B_plus) + V_minus*B_plus + V_plus*B_minus - V_i*V_minus*(2.0*A_plus+A_i) - V_i*V_plus*(2.0*A_minus+A_i) - A_i*V_minus*V_plus + V_i*V_i*(V_minus+V_plus) + 2.0*V_i*V_minus*V_plus - A_i*B_0
+        A[3*nz+i, 2*nz+i] = scale * (M_plus+2.0*M_i+M_minus) - B_plus - B_0 - B_minus + A_plus*(2.0*V_i+V_minus) + A_minus*(2.0*V_i+V_plus) + A_i*(V_i+V_minus+V_plus) - V_i*V_i - 2.0*V_i*(V_minus+V_plus) - V_minus*V_plus
+        A[3*nz+i, 3*nz+i] = V_plus+2.0*V_i+V_minus-A_plus-A_i-A_minus
+        A[i, nz+i] = 1.0
+        A[nz+i, 2*nz+i] = 1.0
+        A[2*nz+i, 3*nz+i] = 1.0
+    return A
+
+
+@pytest.mark.parametrize("model", ["Parabolic", "Taylor", "Kane"])
+def test_sparse_assembly_matches_lil_loops(model):
+    S = make_solver([[100, 0.3], [60, 0], [20, 0.15], [100, 0.3]], 5, "FDM", model, 3, dz=1.3)
+    scale = (ConstAndScales.HBAR / S.G.get_dz())**2 / 4.0
+    A = S.construct_matrix()
+    if model == "Parabolic":
+        np.testing.assert_array_equal(A.toarray(), lil_parabolic(S, scale).toarray())
+    elif model == "Kane":
+        np.testing.assert_array_equal(A.toarray(), lil_kane(S, scale).toarray())
+    else:
+        A_lil, B_lil = lil_taylor(S, scale)
+        B = S.construct_overlap_matrix()
+        for M, M_lil in [(A, A_lil.toarray()), (B, B_lil.toarray())]:
+            M = M.toarray()
+            np.testing.assert_array_equal(M[1:-1], M_lil[1:-1])
+            np.testing.assert_array_equal(M[[0, -1], [1, -2]], M_lil[[0, -1], [1, -2]])
+            np.testing.assert_array_equal(M[[0, -1], [0, -1]], M[[1, -2], [1, -2]])
+
+
+def test_parabolic_tridiagonal_solve_matches_dense_and_window():
+    S = make_solver([[100, 0.45], [150, 0], [30, 0.2], [60, 0], [100, 0.45]], 5, "FDM", "Parabolic", 0)
+    dense = np.sort(np.linalg.eigvals(S.construct_matrix().toarray()).real)
+    Emin, Emax = S.get_energy_window()
+    dense = dense[(Emin < dense) & (dense < Emax)] / ConstAndScales.meV
+    energies, psis = S.get_wavefunctions()
+    np.testing.assert_allclose(energies / ConstAndScales.meV, dense, rtol=0, atol=1e-8)
+    assert len(psis) == len(dense)
+
+    # A window keeps exactly the states inside it
+    S.set_energy_window(dense[1] - 1.0, dense[3] + 1.0)
+    windowed, _ = S.get_wavefunctions()
+    np.testing.assert_allclose(windowed / ConstAndScales.meV, dense[1:4], rtol=0, atol=1e-8)
+
+
+def test_scan_batched_empty_range():
+    S = make_solver([[200, 0.2], [100, 0], [200, 0.2]], 0, "TMM", "Parabolic", 3)
+    Emax = max(S.V - 5*S.G.get_dE())
+    assert S.scan_batched(Emin=Emax) == []
+
+
+@pytest.mark.parametrize("nst", [0, 3])
+def test_scan_nodes_without_range_above_band_edges(nst):
+    # Unbiased, the band edges at both ends are the top of the scan range, so
+    # nothing is left for the batched fallback
+    layers = [[200, 0.2], [100, 0], [200, 0.2]]
+    energies, _ = make_solver(layers, 0, "TMM", "Parabolic", nst, scan_mode="nodes").get_wavefunctions()
+    batched, _ = make_solver(layers, 0, "TMM", "Parabolic", nst, scan_mode="batched").get_wavefunctions()
+    assert len(energies) == len(batched) > 0
+    np.testing.assert_allclose(energies, batched, rtol=1e-6)
+
+
+@pytest.mark.parametrize("nst", [0, 3])
+def test_scan_nodes_matches_batched_on_biased_well(nst):
+    # Biased, the node count ends at the band edge on the right, where M11 is
+    # NaN; it must not bracket a level there
+    layers = [[200, 0.2], [100, 0], [200, 0.2]]
+    S = make_solver(layers, 5, "TMM", "Parabolic", nst, scan_mode="nodes")
+    energies, _ = S.get_wavefunctions()
+    batched, _ = make_solver(layers, 5, "TMM", "Parabolic", nst, scan_mode="batched").get_wavefunctions()
+    fdm, _ = make_solver(layers, 5, "FDM", "Parabolic", nst).get_wavefunctions()
+    assert np.all(energies < S.V[-1])
+    assert len(energies) == len(batched) == 2
+    np.testing.assert_allclose(energies, batched, rtol=1e-6)
+    np.testing.assert_allclose(energies / ConstAndScales.meV, fdm[:2] / ConstAndScales.meV, atol=0.05)
+
+
+@pytest.mark.parametrize("layers, K, n_above", [
+    # The last level lies above the band edge on the right and is left to the
+    # batched fallback, which starts on that value of V
+    ([[200, 0.3], [150, 0], [200, 0.3]], 10, 1),
+    # The last level lies 12 meV below the band edge on the right, where the
+    # node count steps away from it
+    ([[100, 0.45], [200, 0], [100, 0.45]], 12, 0),
+])
+@pytest.mark.parametrize("nst", [0, 5])
+def test_scan_nodes_matches_batched_near_band_edge(layers, K, n_above, nst):
+    S = make_solver(layers, K, "TMM", "Parabolic", nst, scan_mode="nodes")
+    energies, _ = S.get_wavefunctions()
+    batched, _ = make_solver(layers, K, "TMM", "Parabolic", nst, scan_mode="batched").get_wavefunctions()
+    assert np.count_nonzero(energies > min(S.V[0], S.V[-1])) == n_above
+    assert len(energies) == len(batched)
+    np.testing.assert_allclose(energies, batched, rtol=1e-6)
+
+
+def test_refine_root_rejects_bracket_without_minimum():
+    S = make_solver([[200, 0.2], [100, 0], [200, 0.2]], 5, "TMM", "Parabolic", 3)
+    E1 = S.get_wavefunctions()[0][0]
+    dE = S.G.get_dE()
+    Ex, _ = S.refine_root(E1 - 3*dE, E1 + 3*dE)
+    assert Ex == pytest.approx(E1, rel=1e-9)
+    assert S.refine_root(E1 + dE, E1 + 5*dE)[0] is None
+
+
+@pytest.mark.parametrize("model, E1", [("Parabolic", 22.844), ("Kane", 23.242)])
+@pytest.mark.parametrize("scan_mode", ["batched", "serial"])
+def test_scan_finds_structure2_ground_state(scan_mode, model, E1):
+    # At dz = 1 Å the scan energies and bracket midpoints fall on values of V
+    # next to the ground state, where M11 is NaN
+    G = Grid(Composition.from_file(os.path.join(test_dir, "Structure2_LO_InGaAs_InAlAs.txt")), 1.0, "InGaAs_InAlAs")
+    G.set_K(10)
+    S = SolverFactory.create(G, "TMM", model, 3)
+    S.set_cache(None)
+    S.set_scan_mode(scan_mode)
+    energies, _ = S.get_wavefunctions()
+    assert not np.any(np.isnan(S.get_m11(S.get_scan_energies())))
+    assert energies[0] / ConstAndScales.meV == pytest.approx(E1, abs=1e-3)
+
+
+@pytest.mark.parametrize("layer_file, material, K, model, nst", [
+    # Three levels 2 meV apart lie between two coarse samples
+    ("Structure1_BTC_GaAs_AlGaAs.txt", "AlGaAs", 1.9, "Ekenberg", 10),
+    # |M11| has a minimum 0.3 meV below the top of the range
+    ("Structure2_LO_InGaAs_InAlAs.txt", "InGaAs_InAlAs", 10.0, "Parabolic", 0),
+    ("Structure2_LO_InGaAs_InAlAs.txt", "InGaAs_InAlAs", 10.0, "Kane", 0),
+])
+def test_scan_adaptive_matches_batched(layer_file, material, K, model, nst):
+    G = Grid(Composition.from_file(os.path.join(test_dir, layer_file)), 1.0, material)
+    G.set_K(K)
+    results = {}
+    for scan_mode in ("batched", "adaptive"):
+        S = SolverFactory.create(G, "TMM", model, nst)
+        S.set_cache(None)
+        S.set_scan_mode(scan_mode)
+        results[scan_mode] = S.get_wavefunctions()[0] / ConstAndScales.meV
+    assert len(results["adaptive"]) == len(results["batched"])
+    np.testing.assert_allclose(results["adaptive"], results["batched"], atol=1e-3)
+
+
+@pytest.mark.parametrize("layer_file, material, K, dz", [
+    ("Structure1_BTC_GaAs_AlGaAs.txt", "AlGaAs", 1.9, 0.5),
+    ("Structure2_LO_InGaAs_InAlAs.txt", "InGaAs_InAlAs", 10.0, 0.6),
+    ("Structure3_LO_InGaAs_GaAsSb.txt", "InGaAs_GaAsSb", 8.0, 1.0),
+])
+def test_kane_engines_find_same_states(layer_file, material, K, dz):
+    # Both engines solve the same discrete problem, including the states near
+    # the top of the window that touch the boundaries
+    G = Grid(Composition.from_file(os.path.join(test_dir, layer_file)), dz, material)
+    G.set_K(K)
+    energies, psis = {}, {}
+    for engine in ["companion", "nonlinear"]:
+        S = SolverFactory.create(G, "FDM", "Kane", 0)
+        S.set_cache(None)
+        S.set_engine(engine)
+        E, psi = S.get_wavefunctions()
+        energies[engine], psis[engine] = E / ConstAndScales.meV, np.array(psi)
+    assert len(energies["nonlinear"]) == len(energies["companion"])
+    np.testing.assert_allclose(energies["nonlinear"], energies["companion"], rtol=0, atol=1e-6)
+    overlaps = abs(np.sum(psis["nonlinear"].conj() * psis["companion"], axis=1))
+    overlaps /= np.linalg.norm(psis["nonlinear"], axis=1) * np.linalg.norm(psis["companion"], axis=1)
+    np.testing.assert_allclose(overlaps, 1.0, atol=1e-9)
+
+
+@pytest.mark.parametrize("chain_chunk", [1, 7, 100])
+def test_streamed_m11_derivative_matches_whole_grid(chain_chunk):
+    G = Grid(Composition.from_file(os.path.join(test_dir, "Structure1_BTC_GaAs_AlGaAs.txt")), 0.5, "AlGaAs")
+    G.set_K(1.9)
+    S = SolverFactory.create(G, "TMM", "Kane", 3)
+    energies = S.get_scan_energies()[::50]
+    TM, dTM = S._chain_product_dual(*S.get_transfer_matrices_with_derivative(energies))
+    S.set_chain_chunk(chain_chunk)
+    m11, dm11 = S.get_m11_with_derivative(energies)
+    np.testing.assert_allclose(m11, TM[..., 0, 0], rtol=1e-10)
+    np.testing.assert_allclose(dm11, dTM[..., 0, 0], rtol=1e-10)
+
+
+def test_batch_stats_include_grid_profiles():
+    from src.BatchRunner import BatchTask, run_task
+
+    task = BatchTask("well", 0, [[200, 0.2], [100, 0], [200, 0.2]], "AlGaAs", 1.0, 0.0,
+                     "FDM", "Parabolic", 3, stats=True, cache=False)
+    record = run_task(task)
+    assert "error" not in record
+    assert {"grid_profiles", "solve"} <= set(record["stats"]["timings"])
+
+
+def test_sweep_stats_include_grid_profiles():
+    from src.TransitionSweep import TransitionSweep
+
+
+    layers = Composition.from_array([[200, 0.2], [100, 0], [200, 0.2]])
+    sweep = TransitionSweep(layers, "AlGaAs", 1.0, "FDM", "Parabolic", 3, 2, 1)
+    sweep.set_stats(True)
+    _, _, stats = sweep.solve_point(0.0, 0.2, 100)
+    assert {"setup", "grid_profiles", "solve"} <= set(stats["timings"])
+
+
+def test_sweep_matches_point_by_point_solves():
+    from src.TransitionCalculator import TransitionCalculator
+    from src.TransitionSweep import TransitionSweep
+
+    layers = [[150, 0.2], [60, 0], [150, 0.2]]
+    K_values, heights, widths = [0.0, 10.0], [0.1, 0.3], [30, 80]
+    sweep = TransitionSweep(Composition.from_array(layers), "AlGaAs", 1.0, "FDM", "Parabolic", 3, 2, 1)
+    sweep.set_parallel(False)
+    result = sweep.run(K_values, heights, widths)
+
+    for a, K in enumerate(K_values):
+        for b, h in enumerate(heights):
+            for c, w in enumerate(widths):
+                S = make_solver([[150, h], [w, 0], [150, h]], K, "FDM", "Parabolic", 3)
+                energies, psis = S.get_wavefunctions()
+                expected = TransitionCalculator().calculate(S.G.z, energies, psis, 2, 1)
+                expected = [np.nan if v is None else v for v in expected]
+                actual = result.ediff[a, b, c], result.dipoles[a, b, c], result.osc_strength[a, b, c]
+                np.testing.assert_allclose(actual, expected, rtol=1e-8)
+    # The shallow, narrow well has a single level
+    assert np.isnan(result.ediff[0, 0, 0])
+
+    sweep.set_parallel(True)
+    sweep.set_chunksize(3)
+    parallel = sweep.run(K_values, heights, widths)
+    np.testing.assert_allclose(parallel.dipoles, result.dipoles, rtol=1e-8)
+
+
+@pytest.mark.parametrize("parallel", [False, True])
+def test_sweep_streams_every_point_once(parallel):
+    from src.TransitionSweep import TransitionSweep
+
+    sweep = TransitionSweep(Composition.from_array([[150, 0.2], [60, 0], [150, 0.2]]), "AlGaAs", 1.0,
+                            "FDM", "Parabolic", 3, 2, 1)
+    sweep.set_parallel(parallel)
+    sweep.set_chunksize(1)
+    K_values, heights, widths = [0.0, 10.0], [0.3], [50, 70, 90]
+    points = list(sweep.iter_results(K_values, heights, widths))
+    assert sorted(p.index for p in points) == [(a, 0, c) for a in range(2) for c in range(3)]
+    for p in points:
+        assert (p.K, p.height, p.width) == (K_values[p.index[0]], heights[p.index[1]], widths[p.index[2]])
+
+    progress = []
+    result = sweep.run(K_values, heights, widths, progress=lambda done, total: progress.append((done, total)))
+    assert progress == [(n, 6) for n in range(1, 7)]
+    for p in points:
+        assert result.dipoles[p.index] == pytest.approx(p.dipole, rel=1e-8)
+
+
+def test_sweep_plot_keeps_streamed_points_in_order():
+    from src.Sweep_Visualisation import SweepVisualisation
+
+    plot = SweepVisualisation([], [], [], [], "width", k_values=[0.0, 10.0])
+    for k_index, x in [(1, 70), (0, 90), (1, 50), (0, 50), (1, 90), (0, 70)]:
+        plot.append_point(k_index, x, x + 1, x + 2, x + 3)
+    assert plot.trace_x == [[50, 70, 90], [50, 70, 90]]
+    assert plot.ediff == [[51, 71, 91], [51, 71, 91]]
+    assert plot.osc_strength[1] == [53, 73, 93]
+
+
+@pytest.mark.parametrize("solver, model", [("FDM", "Taylor"), ("TMM", "Kane")])
+def test_transition_matrices_match_calculate(solver, model):
+    from src.TransitionCalculator import TransitionCalculator
+
+    S = make_solver([[200, 0.3], [80, 0], [30, 0.3], [60, 0], [200, 0.3]], 5, solver, model, 4)
+    energies, psis = S.get_wavefunctions()
+    T = TransitionCalculator()
+    ediff, dipoles, osc_strength = T.get_transition_matrices(S.G.z, energies, psis)
+    n = len(energies)
+    assert ediff.shape == dipoles.shape == osc_strength.shape == (n, n)
+    for i in range(1, n+1):
+        for j in range(1, n+1):
+            e, d, f = T.calculate(S.G.z, energies, psis, i, j)
+            assert ediff[i-1, j-1] == pytest.approx(e, rel=1e-12, abs=1e-30)
+            assert dipoles[i-1, j-1] == pytest.approx(d, rel=1e-8, abs=1e-8*np.max(dipoles))
+            assert osc_strength[i-1, j-1] == pytest.approx(f, rel=1e-8, abs=1e-8*np.max(abs(osc_strength)))
+            # The dipole is the trapezoid integral of psi_i z psi_j
+            assert d == pytest.approx(abs(np.trapezoid(psis[i-1] * S.G.z * psis[j-1], S.G.z)) / T.A, rel=1e-10)
+
+
+def test_batch_command_line_writes_a_line_per_task(tmp_path):
+    import json
+    import subprocess
+
+    layers = [[200, 0.2], [100, 0], [200, 0.2]]
+    jobs = {
+        "defaults": {"solver": "FDM", "nonparabolicity": "Parabolic", "nstmax": 3, "material": "AlGaAs", "dz": 1.0},
+        "jobs": [
+            {"name": "well", "layers": layers, "K": [0, 5], "transitions": "all"},
+            {"name": "bad", "layers": layers, "K": 0, "settings": {"no_such_setting": 1}},
+        ],
+    }
+    (tmp_path / "jobs.json").write_text(json.dumps(jobs))
+    output = tmp_path / "results.jsonl"
+    run = subprocess.run([sys.executable, "Batch.py", str(tmp_path / "jobs.json"), "--serial", "--output", str(output)],
+                         cwd=os.path.join(test_dir, ".."), capture_output=True, text=True)
+    assert run.returncode == 1
+    assert "1 of 3 jobs failed" in run.stderr
+
+    records = [json.loads(line) for line in output.read_text().splitlines()]
+    assert [(r["job"], r["index"]) for r in records] == [("well", 0), ("well", 1), ("bad", 0)]
+    assert "AttributeError" in records[2]["error"]
+    for record in records[:2]:
+        energies, _ = make_solver(layers, record["K"], "FDM", "Parabolic", 3).get_wavefunctions()
+        np.testing.assert_allclose(record["energies"], energies / ConstAndScales.meV, rtol=1e-10)
+        n = len(energies)
+        assert [(t["i"], t["j"]) for t in record["transitions"]] == [(i, j) for i in range(2, n+1) for j in range(1, i)]
+
+
+def test_result_cache_is_opt_in_and_keyed_on_source(monkeypatch):
+    from src import ResultCache
+
+    S = make_solver([[200, 0.2], [100, 0], [200, 0.2]], 5, "FDM", "Parabolic", 3)
+    monkeypatch.setattr(ResultCache, "_enabled", False)
+    assert ResultCache.get_default_cache() is None
+
+    key = S.get_cache_key()
+    monkeypatch.setattr(ResultCache, "_source_digest", "edited")
+    assert S.get_cache_key() != key
@@ -5,6 +5,7 @@ class CalculatorPage:
         st.title("Electronic Structure Calculator")
 
         from src.Visualisation import Visualisation
+        from ui import jobs
         from ui.user_inputs import CalculatorInputs
 
         Inputs = CalculatorInputs()
@@ -12,24 +13,49 @@ class CalculatorPage:
 
         if Inputs.solver is None or Inputs.composition is None:
             st.markdown(":red-badge[**<Calculate> button only appears once all fields are filled.**]")
-
-        else:
-            if st.button("Calculate"):
-                from src.Grid import Grid
-                from src.Solvers_FDM import SolverFactory
-
-                # setup for calculation
-                G = Grid(Inputs.composition, Inputs.dz, Inputs.material)
-                G.set_K(Inputs.K_values[0])
-                
-                # get solver outputs: energies, psis
-                solver = SolverFactory.create(G, Inputs.solver, Inputs.nonparabolicity, Inputs.nstmax)
-                energies, psis = solver.get_wavefunctions()
-
-                # plot graphs using plotly
-                V = Visualisation(G, energies, psis)
-
-                st.plotly_chart(V.plot_V_wf())
-                st.plotly_chart(V.plot_energies())
-                st.plotly_chart(V.plot_energy_diff_thz())
-                st.plotly_chart(V.plot_QCL(Inputs.K_values[0], Inputs.padding, False, None))
+            return
+
+        # Widget changes rerun the page, so the solve runs as a background
+        # job and the page shows its result for as long as the inputs match
+        args = (
+            jobs.get_layers_key(Inputs.composition.as_array()),
+            Inputs.dz,
+            Inputs.material,
+            Inputs.K_values[0],
+            Inputs.solver,
+            Inputs.nonparabolicity,
+            Inputs.nstmax
+        )
+
+        if st.button("Calculate"):
+            st.session_state["calculator_job"] = (args, jobs.submit_solve(*args))
+
+        job_args, job = st.session_state.get("calculator_job", (None, None))
+        if job is None or job_args != args:
+            return
+
+        if not job.done():
+            st.info("Calculating. Please wait.")
+            jobs.poll(job)
+        if job.failed():
+            st.error(f"Calculation failed: {job.future.exception()}")
+            return
+
+        # get solver outputs: energies, psis
+        energies, psis, stats = job.result()
+        G = jobs.get_grid(*args[:4])
+
+        # plot graphs using plotly
+        V = Visualisation(G, energies, psis)
+
+        st.plotly_chart(V.plot_V_wf())
+        st.plotly_chart(V.plot_energies())
+        st.plotly_chart(V.plot_energy_diff_thz())
+        st.plotly_chart(V.plot_QCL(Inputs.K_values[0], Inputs.padding, False, None))
+
+        if stats:
+            from src.SolverStats import SolverStats
+
+            with st.expander("Solver profile"):
+                st.code(SolverStats.from_dict(stats).log_line())
+                st.json(stats)
@@ -4,134 +4,100 @@ class EnergyDifferencePage:
     def render(self):
         st.title("Transition Calculator")
         
-        from src.Grid import Grid
-        from src.Composition import Composition
-        from src.Solvers_FDM import SolverFactory
-
         from .user_inputs import EnergyDiffInputs
         Inputs = EnergyDiffInputs()
         Inputs.render_energy_diff_inputs()
 
         import src.ConstAndScales
-        from src.TransitionCalculator import TransitionCalculator
 
-        if None in (Inputs.solver, Inputs.composition, Inputs.sweep_param):
+        if None in (Inputs.solver, Inputs.composition, Inputs.sweep_param) or not hasattr(Inputs, "i"):
             st.markdown(":red-badge[**<Calculate> button only appears once all fields are filled.**]")
             return
 
+        from src.Sweep_Visualisation import SweepVisualisation
+        from src.TransitionSweep import TransitionSweep
+        from ui import jobs
+
+        K_list = Inputs.K_values if hasattr(Inputs, "K_values") else [Inputs.K]
+
+        sweep = TransitionSweep(
+            Inputs.composition,
+            Inputs.material,
+            Inputs.dz,
+            Inputs.solver,
+            Inputs.nonparabolicity,
+            Inputs.nstmax,
+            Inputs.i,
+            Inputs.j
+        )
+
+        # The sweep runs as a background job, shared with any session asking
+        # for the same sweep. The page redraws the points finished so far
+        # until it completes, and keeps showing it while the inputs match.
+        key = jobs.get_sweep_key(sweep, K_list, Inputs.heights, Inputs.widths)
         if st.button("Calculate"):
-            progress_text = "Calculating. Please wait."
-            pbar_val = 0
-            p_bar = st.progress(pbar_val, text=progress_text)
-
-            from src.Sweep_Visualisation import SweepVisualisation
-
-            K_list = Inputs.K_values if hasattr(Inputs, "K_values") else [Inputs.K]
-
-            total_steps = len(K_list) * len(Inputs.heights) * len(Inputs.widths)
-
-            # =========================
-            # STORE PER-K TRACES
-            # =========================
-            all_ediff = []
-            all_dipole = []
-            all_osc = []
-
-            plot_heights = []
-            plot_height2 = []
-
-            for K in K_list:
-
-                ediff_trace = []
-                dipole_trace = []
-                osc_trace = []
-
-                for h in Inputs.heights:
-                    plot_widths = []
-
-                    for w in Inputs.widths:
-                        arr = Inputs.composition.as_array()  # type: ignore
-                        arr[1][0] = w
-                        arr[0][1] = h
-                        arr[-1][1] = h
-                    
-                        C2 = Composition.from_array(arr)
-
-                        G = Grid(C2, Inputs.dz, Inputs.material)
-                        G.set_K(K)
-
-                        solver = SolverFactory.create(
-                            G,
-                            Inputs.solver,
-                            Inputs.nonparabolicity,
-                            Inputs.nstmax
-                        )
-
-                        energies, wavefunctions = solver.get_wavefunctions()
-
-                        T = TransitionCalculator()
-                        ediff, dipoles, osc_str = T.calculate(
-                            G.z, energies, wavefunctions, Inputs.i, Inputs.j
-                        )
-
-                        if None not in (ediff, dipoles, osc_str):
-                            plot_widths.append(w)
-
-                            barrier_height = (
-                                src.ConstAndScales.E
-                                * Inputs.M.interpolate_parameter(h, Inputs.M.V)
-                                / src.ConstAndScales.meV
-                            )
-
-                            plot_height2.append(barrier_height)
-                            plot_heights.append(h)
-
-                            ediff_trace.append(ediff / src.ConstAndScales.meV)
-                            dipole_trace.append(dipoles / src.ConstAndScales.nano)
-                            osc_trace.append(osc_str / src.ConstAndScales.E)
-
-                        pbar_val += int(100 / total_steps)
-                        p_bar.progress(min(pbar_val, 100), text=progress_text)
-
-                # store per-K result (CRITICAL FIX)
-                all_ediff.append(ediff_trace)
-                all_dipole.append(dipole_trace)
-                all_osc.append(osc_trace)
-
-            # =========================
-            # PASS STRUCTURED DATA
-            # =========================
-
-            match Inputs.sweep_param:
-
-                case "Sweep Well Width":
-                    typ = "Well Width"
-
-                    V = SweepVisualisation(
-                        all_ediff,
-                        all_dipole,
-                        all_osc,
-                        Inputs.widths,
-                        typ,
-                        None,
-                        K_list
-                    )
-
-                case "Sweep Molar Content":
-                    typ = "Molar Content"
-
-                    V = SweepVisualisation(
-                        all_ediff,
-                        all_dipole,
-                        all_osc,
-                        plot_heights,
-                        typ,
-                        plot_height2,
-                        K_list
-                    )
-
-            st.plotly_chart(V.ediff_plot())
-            st.plotly_chart(V.dipoles_plot())
-            st.plotly_chart(V.osc_str_plot())
-
-            p_bar.empty()
+            st.session_state["sweep_job"] = (key, jobs.submit_sweep(sweep, K_list, Inputs.heights, Inputs.widths))
+
+        job_key, job = st.session_state.get("sweep_job", (None, None))
+        if job is None or job_key != key:
+            return
+
+        match Inputs.sweep_param:
+            case "Sweep Well Width":
+                typ = "Well Width"
+                x2_vals = None
+            case "Sweep Molar Content":
+                typ = "Molar Content"
+                x2_vals = list(sweep.get_barrier_heights(Inputs.heights))
+
+        # One of heights and widths holds a single value, so each K gives
+        # one trace along the swept parameter
+        V = SweepVisualisation(
+            [[] for _ in K_list],
+            [[] for _ in K_list],
+            [[] for _ in K_list],
+            [],
+            typ,
+            x2_vals,
+            K_list
+        )
+
+        points = list(job.points)
+        total = len(K_list) * len(Inputs.heights) * len(Inputs.widths)
+        for point in points:
+            x = point.width if typ == "Well Width" else point.height
+            V.append_point(
+                point.index[0],
+                x,
+                point.ediff / src.ConstAndScales.meV,
+                point.dipole / src.ConstAndScales.nano,
+                point.osc_strength / src.ConstAndScales.E
+            )
+
+        if job.failed():
+            st.error(f"Calculation failed: {job.future.exception()}")
+        elif not job.done():
+            st.progress(int(100*len(points)/total), text="Calculating. Please wait.")
+
+        st.plotly_chart(V.ediff_plot())
+        st.plotly_chart(V.dipoles_plot())
+        st.plotly_chart(V.osc_str_plot())
+
+        stats = jobs.get_sweep_stats(points)
+        if stats.enabled:
+            with st.expander("Solver profile"):
+                st.code(stats.log_line())
+                # Slowest points first, to spot pathological structures
+                slowest = sorted((p for p in points if p.stats is not None),
+                                 key=lambda p: -p.stats["timings"]["point"])[:10]
+                st.dataframe([{
+                    "K (kV/cm)": p.K,
+                    "Height": p.height,
+                    "Width (Å)": p.width,
+                    "Time (s)": p.stats["timings"]["point"],
+                    "States": p.stats["counters"].get("states", 0),
+                    "Cache hits": p.stats["counters"].get("cache_hits", 0),
+                } for p in slowest])
+
+        jobs.poll(job)
+
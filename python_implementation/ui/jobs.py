@@ -0,0 +1,155 @@
+#
+#   Memoised grids and solves for the Streamlit pages, and background jobs
+#   for the long computations. Jobs run in an executor shared by every
+#   session, so the script thread only polls them and users do not wait
+#   behind each other's solves.
+#
+
+import contextlib
+import copy
+from concurrent.futures import ThreadPoolExecutor
+import threading
+import time
+
+import streamlit as st
+
+POLL_INTERVAL = 0.5     # s between reruns of a page waiting on a job
+MAX_JOBS = 32           # finished jobs kept for reuse
+
+
+def get_layers_key(layers):
+    """Hashable form of a layer array (Composition.as_array), for cache and
+    job keys."""
+    return tuple(map(tuple, layers.tolist()))
+
+
+@st.cache_resource
+def get_executor():
+    return ThreadPoolExecutor(max_workers=4, thread_name_prefix="dtmm-job")
+
+
+@st.cache_resource(max_entries=32)
+def _get_shared_grid(layers, dz, material, K):
+    from src.Composition import Composition
+    from src.Grid import Grid
+
+    G = Grid(Composition.from_array(layers), dz, material)
+    G.set_K(K)
+    return G
+
+
+def get_grid(layers, dz, material, K):
+    """Grid of a structure. The grid is built once and shared by every
+    session, and each caller gets its own copy, so set_K on it cannot change
+    the profiles other sessions see."""
+    return copy.deepcopy(_get_shared_grid(layers, dz, material, K))
+
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def solve(layers, dz, material, K, solver, nonparabolicity, nstmax):
+    """Energies and wavefunctions of a structure, as from get_wavefunctions,
+    and the solver's stats as a dict (empty unless DTMM_STATS is set). The
+    stats also go to the "dtmm" logger."""
+    from src.Solvers_FDM import SolverFactory
+
+    S = SolverFactory.create(get_grid(layers, dz, material, K), solver, nonparabolicity, nstmax)
+    energies, psis = S.get_wavefunctions()
+    S.get_stats().log(prefix=f"{solver}:{nonparabolicity} K={K} dz={dz} {material} layers={layers}")
+    return energies, psis, S.get_stats().as_dict()
+
+
+class Job:
+    def __init__(self, func, *args) -> None:
+        """Run func(job, *args) in the shared executor. func can append
+        partial results to job.points for the page to show while it runs.
+        """
+        self.points = []
+        self.future = get_executor().submit(func, self, *args)
+
+    def done(self):
+        return self.future.done()
+
+    def failed(self):
+        return self.future.done() and self.future.exception() is not None
+
+    def result(self):
+        return self.future.result()
+
+
+class JobRegistry:
+    """Jobs by key, shared by every session, so a second request for the same
+    inputs joins the running job or reuses its result."""
+
+    def __init__(self) -> None:
+        self.jobs = {}
+        self.lock = threading.Lock()
+
+    def submit(self, key, func, *args):
+        with self.lock:
+            job = self.jobs.get(key)
+            if job is None or job.failed():
+                job = Job(func, *args)
+                self.jobs[key] = job
+
+            finished = [k for k, j in self.jobs.items() if j.done() and k != key]
+            for k in finished[:max(0, len(self.jobs) - MAX_JOBS)]:
+                del self.jobs[k]
+            return job
+
+
+@st.cache_resource
+def get_jobs():
+    return JobRegistry()
+
+
+def submit_solve(*args):
+    """Background job for solve(*args)."""
+    return get_jobs().submit(("solve",) + args, lambda job, *a: solve(*a), *args)
+
+
+def get_sweep_key(sweep, K_values, heights, widths):
+    return ("sweep", get_layers_key(sweep.layers), sweep.material, sweep.dz, sweep.solver,
+            sweep.nonparabolicity, sweep.nstmax, sweep.i, sweep.j,
+            tuple(K_values), tuple(heights), tuple(widths))
+
+
+def submit_sweep(sweep, K_values, heights, widths):
+    """Background job for a TransitionSweep. Its points list fills with
+    SweepPoint results as they complete."""
+    key = get_sweep_key(sweep, K_values, heights, widths)
+    return get_jobs().submit(key, _run_sweep, sweep, K_values, heights, widths)
+
+
+def _run_sweep(job, sweep, K_values, heights, widths):
+    with contextlib.closing(sweep.iter_results(K_values, heights, widths)) as points:
+        for point in points:
+            job.points.append(point)
+
+    stats = get_sweep_stats(job.points)
+    if stats.enabled:
+        slowest = max(job.points, key=lambda p: p.stats["timings"]["point"])
+        stats.log(prefix=f"sweep {sweep.solver}:{sweep.nonparabolicity} of {len(job.points)} points, "
+                         f"slowest K={slowest.K} h={slowest.height} w={slowest.width}")
+    return job.points
+
+
+def get_sweep_stats(points):
+    """SolverStats summed over the SweepPoints that carry stats, or NULL_STATS
+    when none do."""
+    from src import SolverStats
+
+    recorded = [p.stats for p in points if p.stats is not None]
+    if not recorded:
+        return SolverStats.NULL_STATS
+    stats = SolverStats.SolverStats()
+    for point_stats in recorded:
+        stats.merge(point_stats)
+    return stats
+
+
+def poll(job):
+    """Rerun the page after POLL_INTERVAL while job is running. Call last,
+    after drawing whatever the job has produced so far."""
+    if not job.done():
+        time.sleep(POLL_INTERVAL)
+        st.rerun()